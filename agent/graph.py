@@ -1,44 +1,93 @@
 """LangGraph workflow orchestration"""
+import hashlib
+from typing import Optional
+import aiosqlite
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from langgraph.graph import StateGraph, END
 from .state import EmailAgentState
 from .nodes import AgentNodes
 from integrations.llm_wrapper import UnifiedLLM
 
+_checkpointer: Optional[AsyncSqliteSaver] = None
+
+# Terminal steps of a run that needed no fallback; fallback nodes also set "error"
+_CLEAN_END_STEPS = frozenset({"classified", "proposal_generated"})
+
+async def get_checkpointer(path: str = "checkpoints.db") -> AsyncSqliteSaver:
+    """Shared SQLite checkpointer; must be created inside the running event loop"""
+    global _checkpointer
+    if _checkpointer is None:
+        conn = await aiosqlite.connect(path)
+        # WAL so checkpoint writes don't block readers; NORMAL skips the fsync per commit
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        _checkpointer = AsyncSqliteSaver(conn)
+    return _checkpointer
+
+async def close_checkpointer():
+    """Close the shared checkpointer's connection; its worker thread otherwise blocks interpreter exit"""
+    global _checkpointer
+    if _checkpointer is not None:
+        await _checkpointer.conn.close()
+        _checkpointer = None
+
+def _thread_key(email_data: dict) -> str:
+    """Stable checkpoint key for an email.
+    
+    IMAP sequence numbers (StandardEmailService ids) are reused after mail is
+    archived, so keying on them would return another email's finished run.
+    """
+    if email_data.get("message_id"):
+        return email_data["message_id"]
+    if "message_id" not in email_data:
+        return email_data["id"]  # Gmail API ids are permanent
+    # IMAP message without a Message-ID header: key on its content instead
+    content = "\0".join((email_data["from"] or "", email_data["subject"] or "", email_data["body"] or ""))
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
 class EmailAgentGraph:
-    def __init__(self, llm: UnifiedLLM):
+    def __init__(self, llm: UnifiedLLM, checkpointer: Optional[BaseCheckpointSaver] = None):
         self.nodes = AgentNodes(llm)
+        self.checkpointer = checkpointer
         self.graph = self._build_graph()
     
     def _build_graph(self):
         workflow = StateGraph(EmailAgentState)
         
         # Add all nodes
-        workflow.add_node("classify", self.nodes.classify_email)
-        workflow.add_node("extract", self.nodes.extract_requirements)
-        workflow.add_node("plan", self.nodes.generate_plan)
+        workflow.add_node("triage", self.nodes.triage_email)
         workflow.add_node("cost", self.nodes.calculate_cost)
         workflow.add_node("propose", self.nodes.generate_proposal)
         
-        # Entry point
-        workflow.set_entry_point("classify")
+        # Entry point; states already triaged by AgentNodes.triage_batch skip the triage node
+        def route_entry(state):
+            if state.get("current_step") == "planned":
+                return "cost"
+            if state.get("current_step") == "classified":
+                return END
+            return "triage"
+        
+        workflow.set_conditional_entry_point(
+            route_entry,
+            {"triage": "triage", "cost": "cost", END: END}
+        )
         
         # Conditional routing
-        def route_after_classify(state):
-            return "extract" if state["is_valid_inquiry"] else END
+        def route_after_triage(state):
+            return "cost" if state["is_valid_inquiry"] else END
         
         workflow.add_conditional_edges(
-            "classify",
-            route_after_classify,
-            {"extract": "extract", END: END}
+            "triage",
+            route_after_triage,
+            {"cost": "cost", END: END}
         )
         
         # Linear flow for valid emails
-        workflow.add_edge("extract", "plan")
-        workflow.add_edge("plan", "cost")
         workflow.add_edge("cost", "propose")
         workflow.add_edge("propose", END)
         
-        return workflow.compile()
+        return workflow.compile(checkpointer=self.checkpointer)
     
     async def process_email(self, email_data: dict) -> dict:
         """Process single email through complete workflow"""
@@ -56,4 +105,24 @@ class EmailAgentGraph:
             "error": None
         }
         
-        return await self.graph.ainvoke(initial_state)
+        config = None
+        if self.checkpointer:
+            # One checkpoint thread per message so an interrupted run can pick up where it stopped
+            config = {"configurable": {"thread_id": _thread_key(email_data)}}
+            snapshot = await self.graph.aget_state(config)
+            if snapshot.values and snapshot.next:
+                initial_state = None  # Resume from the last completed node
+            elif snapshot.values:
+                values = snapshot.values
+                if values["current_step"] in _CLEAN_END_STEPS and values.get("error") is None:
+                    return values
+                # Finished on a fallback (e.g. during an outage); run it again instead of replaying it
+                await self.checkpointer.adelete_thread(config["configurable"]["thread_id"])
+        
+        return await self.graph.ainvoke(initial_state, config)
+    
+    async def forget_emails(self, emails):
+        """Drop the checkpoints of emails that are stored or marked read; nothing will resume them"""
+        if self.checkpointer:
+            for email_data in emails:
+                await self.checkpointer.adelete_thread(_thread_key(email_data))
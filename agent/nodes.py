@@ -1,118 +1,235 @@
 """Individual agent processing nodes"""
+import copy
 import json
-from typing import Dict, Any
+import re
+from typing import Dict, Any, List, Optional, Type, TypeVar
+from pydantic import BaseModel, Field
 from langchain_core.messages import SystemMessage, HumanMessage
+from langgraph.types import StreamWriter
 from integrations.llm_wrapper import UnifiedLLM
+from .prompts import (
+    TRIAGE_SYSTEM, TRIAGE_BATCH_SYSTEM, CLASSIFY_SYSTEM, EXTRACT_SYSTEM, PLAN_SYSTEM, PROPOSAL_SYSTEM,
+    FALLBACK_PROPOSAL
+)
 
-class AgentNodes:
-    def __init__(self, llm: UnifiedLLM):
-        self.llm = llm
-    
-    def _clean_json(self, response: str) -> str:
-        """Clean markdown formatting from JSON response"""
-        response = response.strip()
-        if response.startswith("```json"):
-            response = response[7:]
-        if response.startswith("```"):
-            response = response[3:]
-        if response.endswith("```"):
-            response = response[:-3]
-        return response.strip()
+# Digits and separators in an email username become spaces ("krish_gupta12" -> "krish gupta  ")
+_USERNAME_TRANSLATE = str.maketrans({c: ' ' for c in '0123456789_.-'})
+
+# Classifications below this confidence are treated as not an inquiry, so the graph
+# ends after triage instead of costing and writing a proposal nobody should send
+_MIN_CONFIDENCE = 0.5
+
+# Project types that get the larger fallback plan; whole words (plurals allowed), so
+# "erp" doesn't match "enterprise" or "interpreter"
+_COMPLEX_RE = re.compile(r"\b(?:portfolio|finance|trading|crm|erp|machine learning)s?\b", re.IGNORECASE)
+
+
+def _fallback_plan(complexity: str, hours: int) -> Dict[str, Any]:
+    return {
+        "complexity": complexity,
+        "total_estimated_hours": hours,
+        "phases": [
+            {"name": "Phase 1: Discovery", "tasks": ["Requirements", "Design", "Planning"], "duration": "1-2 weeks", "hours": hours // 5},
+            {"name": "Phase 2: Development", "tasks": ["Backend", "Frontend", "Integration"], "duration": "2-3 weeks", "hours": hours // 5 * 2},
+            {"name": "Phase 3: Testing", "tasks": ["QA", "Bug fixes", "Optimization"], "duration": "1 week", "hours": hours // 5},
+            {"name": "Phase 4: Deployment", "tasks": ["Staging", "Launch", "Monitoring"], "duration": "1 week", "hours": hours // 5},
+        ]
+    }
+
+
+# Keyed by is_complex; deep-copied per use since downstream nodes may mutate the plan
+_FALLBACK_PLANS = {True: _fallback_plan("complex", 160), False: _fallback_plan("medium", 80)}
+
+
+def _format_phases(phases: List[Dict[str, Any]]) -> str:
+    """Bullet list of phases used by the proposal prompt and fallback template"""
+    return "\n".join(f"• {p['name']}: {p['duration']} ({p.get('hours', '?')} hours)" for p in phases)
+
+
+for _plan in _FALLBACK_PLANS.values():
+    _plan["phases_text"] = _format_phases(_plan["phases"])
+
+
+class Classification(BaseModel):
+    is_valid: bool
+    confidence: float
+    reason: str = "No reason provided"
+
+class ClientRequirements(BaseModel):
+    client_name: Optional[str] = None
+    company: Optional[str] = None
+    email: Optional[str] = None
+    project_type: Optional[str] = None
+    requirements: List[str] = Field(default_factory=list)
+    timeline: Optional[str] = None
+    budget: Optional[str] = None
+
+class Phase(BaseModel):
+    name: str
+    duration: str
+    hours: Optional[int] = None
+    tasks: List[str] = Field(default_factory=list)
+
+class ProjectPlan(BaseModel):
+    complexity: str
+    total_estimated_hours: int
+    phases: List[Phase]
+
+class TriagePayload(BaseModel):
+    classification: Classification
+    requirements: Optional[ClientRequirements] = None
+    project_plan: Optional[ProjectPlan] = None
+
+class TriageBatchItem(TriagePayload):
+    email_index: int  # Echoes the "--- Email i of N ---" number the result belongs to
+
+class TriageBatch(BaseModel):
+    results: List[TriageBatchItem]
 
-    async def classify_email(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        """Node 1: Classify if business inquiry with clear rules"""
-        prompt = f"""Classify if this email is a genuine business inquiry needing a proposal.
 
-RULES - Email IS VALID if:
-- Person asks about building/developing something (app, website, tool, system, etc.)
-- Person asks for consulting, training, or professional services
-- Person describes a business problem needing a solution
-- Message is reasonably detailed (not one-word spam)
+T = TypeVar("T", bound=BaseModel)
 
-Rules - Email IS NOT VALID if:
-- It\'s spam, promotional, or recruiting
-- It\'s a job application
-- It\'s generic "I\'ll pay you big money" with no details
-- It\'s obviously auto-generated marketing
 
-Email to analyze:
+class AgentNodes:
+    def __init__(self, llm: UnifiedLLM):
+        self.llm = llm
+    
+    def _email_details(self, state: Dict[str, Any]) -> str:
+        """Dynamic part of the email prompts"""
+        return f"""Email to analyze:
 Subject: {state['email_subject']}
 From: {state['email_from']}
-Body: {state['email_body']}
-
-Return ONLY valid JSON:
-{{
-    "is_valid": true or false,
-    "confidence": 0.0 to 1.0,
-    "reason": "one sentence explanation"
-}}"""
+Body: {state['email_body']}"""
+    
+    async def _invoke_json(self, prompt: str, schema: Type[T], system: Optional[str] = None, max_tries: int = 3) -> T:
+        """Structured call that retries malformed output with the parse error as a hint"""
+        attempt_prompt = prompt
+        for attempt in range(1, max_tries + 1):
+            try:
+                return await self.llm.invoke_json(attempt_prompt, schema, system=system)
+            except ValueError as e:
+                # ValidationError and JSONDecodeError are ValueErrors; provider errors propagate
+                if attempt == max_tries:
+                    raise
+                print(f"[DEBUG] {schema.__name__} parse failed (attempt {attempt}/{max_tries}): {e}")
+                attempt_prompt = (
+                    f"{prompt}\n\nPrevious output failed to parse: {e}. "
+                    f"Return strictly valid JSON matching this schema: {json.dumps(schema.model_json_schema())}"
+                )
+    
+    def _triage_update(self, result: TriagePayload) -> Dict[str, Any]:
+        """State update for one triage result"""
+        classification = result.classification.model_dump()
+        is_valid = classification["is_valid"] and classification["confidence"] >= _MIN_CONFIDENCE
+        if is_valid:
+            if result.requirements is None or result.project_plan is None:
+                raise ValueError("Triage marked the email valid but returned no requirements or plan")
+            data = result.requirements.model_dump()
+            plan = result.project_plan.model_dump()
+            plan["phases_text"] = _format_phases(plan["phases"])
+        
+        print(f"[DEBUG] Classification Result: {classification}")
+        update = {
+            "is_valid_inquiry": is_valid,
+            "confidence_score": classification["confidence"],
+            "classification_reason": classification.get("reason", "No reason provided"),
+            "current_step": "classified"
+        }
+        if is_valid:
+            update.update({
+                **data,
+                "project_plan": plan,
+                "current_step": "planned"
+            })
         
+        return update
+    
+    async def triage_email(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Node 1: Classify, extract and plan in a single LLM round-trip"""
+        try:
+            result = await self._invoke_json(self._email_details(state), TriagePayload, system=TRIAGE_SYSTEM)
+            return self._triage_update(result)
+        except Exception as e:
+            # Fall back to one call per step, which has per-step fallbacks of its own
+            print(f"[DEBUG] Triage failed, running steps separately: {e}")
+            update = await self.classify_email(state)
+            if update["is_valid_inquiry"]:
+                update.update(await self.extract_requirements({**state, **update}))
+                update.update(await self.generate_plan({**state, **update}))
+            return update
+    
+    async def triage_batch(self, states: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """Triage several emails in one LLM call; None entries are left to the triage node"""
+        prompt = "\n\n".join(
+            f"--- Email {i} of {len(states)} ---\n{self._email_details(state)}"
+            for i, state in enumerate(states, 1)
+        )
+        try:
+            batch = await self._invoke_json(prompt, TriageBatch, system=TRIAGE_BATCH_SYSTEM)
+        except Exception as e:
+            print(f"[DEBUG] Batch triage failed, triaging emails one by one: {e}")
+            return [None] * len(states)
+        
+        # Matched on the echoed index, not list position, so a reordered or merged result
+        # can't hand one sender's details to another email
+        by_index, duplicates = {}, set()
+        for result in batch.results:
+            if result.email_index in by_index:
+                duplicates.add(result.email_index)
+            by_index[result.email_index] = result
+        
+        updates = []
+        for index in range(1, len(states) + 1):
+            result = by_index.get(index)
+            if result is None or index in duplicates:
+                print(f"[DEBUG] Batch triage returned no single result for email {index}; triaging it alone")
+                updates.append(None)
+                continue
+            try:
+                updates.append(self._triage_update(result))
+            except ValueError as e:
+                print(f"[DEBUG] Batch triage result rejected: {e}")
+                updates.append(None)
+        return updates
+    
+    async def classify_email(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Node 1: Classify if business inquiry with clear rules"""
         response = None
         try:
-            response = await self.llm.invoke(prompt)
-            result = json.loads(self._clean_json(response))
+            response = await self._invoke_json(self._email_details(state), Classification, system=CLASSIFY_SYSTEM)
+            result = response.model_dump()
             
             print(f"[DEBUG] Classification Result: {result}")
-            state.update({
-                "is_valid_inquiry": result["is_valid"],
+            return {
+                "is_valid_inquiry": result["is_valid"] and result["confidence"] >= _MIN_CONFIDENCE,
                 "confidence_score": result["confidence"],
                 "classification_reason": result.get("reason", "No reason provided"),
                 "current_step": "classified"
-            })
+            }
         except Exception as e:
             # Check if response was empty or blocked
             if not response and not str(e):
                 error_msg = "Empty response from LLM"
             else:
                 error_msg = f"LLM Error: {str(e)}"
-                
-            state.update({
+            
+            return {
                 "is_valid_inquiry": False,
                 "confidence_score": 0.0,
                 "current_step": "classification_failed",
                 "error": error_msg
-            })
-        
-        return state
+            }
     
     async def extract_requirements(self, state: Dict[str, Any]) -> Dict[str, Any]:
         """Node 2: Extract client data with detailed guidance"""
-        prompt = f"""Extract structured information from this inquiry email.
-
-Email:
-From: {state['email_from']}
-Subject: {state['email_subject']}
-Body: {state['email_body']}
-
-EXTRACTION GUIDELINES:
-- client_name: Look for signature, name mentions, or parse from email address
-- company: Business name if mentioned, otherwise null or infer from domain
-- project_type: What they want built (be SPECIFIC, e.g., "Custom CRM for Real Estate", not just "CRM")
-- requirements: 3-5 specific features or requirements mentioned
-- timeline: When they need it (e.g., "ASAP", "3 months", "Q1 2026")
-- budget: Any budget mentioned, or "Flexible" if not stated
-
-EXAMPLE OUTPUT:
-{{
-    "client_name": "Debabrata G.",
-    "company": "Investment Firm",
-    "email": "debabrata@example.com",
-    "project_type": "AI Portfolio Management System",
-    "requirements": ["Real-time tracking", "Risk analysis", "Trading alerts"],
-    "timeline": "3 months",
-    "budget": "$15000-$25000"
-}}
-
-Return ONLY valid JSON with extracted data:"""
-        
         try:
-            response = await self.llm.invoke(prompt)
-            data = json.loads(self._clean_json(response))
+            response = await self._invoke_json(self._email_details(state), ClientRequirements, system=EXTRACT_SYSTEM)
+            data = response.model_dump()
             
-            state.update({
+            return {
                 **data,
                 "current_step": "extracted"
-            })
+            }
         except Exception as e:
             # Intelligent fallback: parse name from email address
             email_from = state['email_from']
@@ -124,11 +241,10 @@ Return ONLY valid JSON with extracted data:"""
                 # Format: "email@example.com" - parse username
                 username = email_from.split('@')[0]
                 # Remove numbers and split camelCase/snake_case
-                import re
-                name_parts = re.sub(r'[0-9_.-]', ' ', username).strip()
+                name_parts = username.translate(_USERNAME_TRANSLATE).strip()
                 client_name = ' '.join(word.capitalize() for word in name_parts.split())
             
-            state.update({
+            return {
                 "client_name": client_name or "Valued Client",
                 "company": None,
                 "project_type": state.get('email_subject', 'Custom Project'),
@@ -137,98 +253,28 @@ Return ONLY valid JSON with extracted data:"""
                 "budget": "Flexible",
                 "current_step": "extraction_fallback",
                 "error": str(e)
-            })
-        
-        return state
+            }
     
     async def generate_plan(self, state: Dict[str, Any]) -> Dict[str, Any]:
         """Node 3: Create detailed 5-phase project breakdown"""
         requirements = ', '.join(state.get('requirements', []))
         
-        prompt = f"""Create a realistic project plan for this inquiry.
-
-Project: {state['project_type']}
+        prompt = f"""Project: {state['project_type']}
 Client: {state['client_name']}
 Company: {state.get('company', 'Unknown')}
 Requirements: {requirements}
-Timeline: {state.get('timeline', 'Not specified')}
-
-PLANNING GUIDELINES:
-- Generate 5 phases: Discovery, Core Dev, Frontend/UI, Testing, Deployment
-- Assign realistic duration and hours per phase
-- Each phase has 4-5 specific tasks
-- Complexity levels: simple (40-80 hrs), medium (80-120 hrs), complex (120-200 hrs)
-- For finance/portfolio projects: assume COMPLEX (160 hrs)
-- For generic/simple projects: assume MEDIUM (80 hrs)
-
-EXAMPLE COMPLEX PROJECT (160 hours):
-{{
-    "complexity": "complex",
-    "total_estimated_hours": 160,
-    "phases": [
-        {{
-            "name": "Phase 1: Discovery & Requirements",
-            "duration": "1.5 weeks",
-            "hours": 20,
-            "tasks": ["Detailed requirements gathering", "Technical design", "Architecture review", "Security planning"]
-        }},
-        {{
-            "name": "Phase 2: Core Backend Development",
-            "duration": "3 weeks",
-            "hours": 60,
-            "tasks": ["Database design", "API endpoints", "Authentication", "Integration services"]
-        }},
-        {{
-            "name": "Phase 3: Frontend & User Interface",
-            "duration": "2 weeks",
-            "hours": 40,
-            "tasks": ["UI/UX design", "React components", "State management", "Responsive design"]
-        }},
-        {{
-            "name": "Phase 4: Testing & Quality Assurance",
-            "duration": "1.5 weeks",
-            "hours": 25,
-            "tasks": ["Unit tests", "Integration tests", "Performance testing", "Security audit"]
-        }},
-        {{
-            "name": "Phase 5: Deployment & Handoff",
-            "duration": "1 week",
-            "hours": 15,
-            "tasks": ["Production setup", "Documentation", "Staff training", "Support plan"]
-        }}
-    ]
-}}
-
-Return ONLY valid JSON with project plan:"""
+Timeline: {state.get('timeline', 'Not specified')}"""
         
         try:
-            response = await self.llm.invoke(prompt)
-            state["project_plan"] = json.loads(self._clean_json(response))
-            state["current_step"] = "planned"
+            response = await self._invoke_json(prompt, ProjectPlan, system=PLAN_SYSTEM)
+            plan = response.model_dump()
+            plan["phases_text"] = _format_phases(plan["phases"])
+            return {"project_plan": plan, "current_step": "planned"}
         except Exception as e:
-            # Fallback based on project type
-            is_complex = "portfolio" in state['project_type'].lower() or "finance" in state['project_type'].lower()
-            
-            if is_complex:
-                hours = 160
-                complexity = "complex"
-            else:
-                hours = 80
-                complexity = "medium"
-            
-            state["project_plan"] = {
-                "complexity": complexity,
-                "total_estimated_hours": hours,
-                "phases": [
-                    {"name": "Phase 1: Discovery", "tasks": ["Requirements", "Design", "Planning"], "duration": "1-2 weeks", "hours": hours // 5},
-                    {"name": "Phase 2: Development", "tasks": ["Backend", "Frontend", "Integration"], "duration": "2-3 weeks", "hours": hours // 5 * 2},
-                    {"name": "Phase 3: Testing", "tasks": ["QA", "Bug fixes", "Optimization"], "duration": "1 week", "hours": hours // 5},
-                    {"name": "Phase 4: Deployment", "tasks": ["Staging", "Launch", "Monitoring"], "duration": "1 week", "hours": hours // 5},
-                ]
-            }
-            state["current_step"] = "planned_fallback"
-        
-        return state
+            # Fallback based on project type, which extraction may leave as None
+            is_complex = _COMPLEX_RE.search(state.get('project_type') or '') is not None
+            plan = copy.deepcopy(_FALLBACK_PLANS[is_complex])
+            return {"project_plan": plan, "current_step": "planned_fallback", "error": str(e)}
     
     async def calculate_cost(self, state: Dict[str, Any]) -> Dict[str, Any]:
         """Node 4: Pure business logic (no LLM)"""
@@ -239,19 +285,15 @@ Return ONLY valid JSON with project plan:"""
             state["project_plan"]["complexity"]
         )
         
-        state["cost_estimate"] = cost_data
-        state["current_step"] = "costed"
-        return state
+        return {"cost_estimate": cost_data, "current_step": "costed"}
     
-    async def generate_proposal(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    async def generate_proposal(self, state: Dict[str, Any], writer: StreamWriter = lambda _: None) -> Dict[str, Any]:
         """Node 5: Generate detailed professional proposal email"""
-        phases = state["project_plan"]["phases"]
-        phases_text = "\n".join([f"• {p['name']}: {p['duration']} ({p.get('hours', '?')} hours)" for p in phases])
+        # Formatted once when the plan is produced; plans from elsewhere are formatted here
+        phases_text = state["project_plan"].get("phases_text") or _format_phases(state["project_plan"]["phases"])
         cost = state["cost_estimate"]
         
-        prompt = f"""Write a professional, personalized proposal email body (NO email headers, NO subject line).
-
-CLIENT DETAILS:
+        prompt = f"""CLIENT DETAILS:
 Name: {state['client_name']}
 Email: {state['email_from']}
 Company: {state.get('company', 'their organization')}
@@ -264,71 +306,27 @@ BUSINESS TERMS:
 Total Hours: {state['project_plan']['total_estimated_hours']}
 Complexity: {state['project_plan']['complexity']}
 Investment: ${cost['min']:,} - ${cost['max']:,}
-Timeline: {state.get('timeline', '8-12 weeks')}
-
-CRITICAL REQUIREMENTS:
-- Address the client by their ACTUAL name: {state['client_name']}
-- Sign with "OttoMail Solutions Team" (NO placeholders like [Your Name])
-- Use proper paragraph breaks (double newlines between sections)
-- DO NOT use placeholders like [Company Name] or [Your Name] - use actual values
-- Be specific about the project type: {state['project_type']}
-
-PROPOSAL STRUCTURE:
-1. Greeting: Address {state['client_name']} personally
-2. Understanding: Show you understand their {state['project_type']} needs
-3. Approach: Your methodology and why it works
-4. Project Breakdown: Summarize the 5 phases with clear formatting
-5. Investment: Cost range ${cost['min']:,} - ${cost['max']:,} and what's included
-6. Business Value: Why this is worth the investment
-7. Next Steps: Clear call-to-action (schedule call, etc.)
-8. Sign-off: "Best regards,\nOttoMail Solutions Team"
-
-TONE: Professional, confident, business-focused (not salesy)
-LENGTH: 400-600 words
-FORMATTING: Use double line breaks between sections for readability
-
-Return ONLY the email body text (no JSON, no markdown formatting, just plain text with line breaks):"""
+Timeline: {state.get('timeline', '8-12 weeks')}"""
         
         try:
-            state["proposal_text"] = await self.llm.invoke(prompt)
-            state["current_step"] = "proposal_generated"
+            # Consume the reply as it is generated instead of waiting for the full completion
+            chunks = []
+            async for chunk in self.llm.stream(prompt, system=PROPOSAL_SYSTEM):
+                chunks.append(chunk)
+                # Surfaces on graph.astream(..., stream_mode="custom"); a no-op otherwise
+                writer({"email_id": state["email_id"], "proposal_chunk": chunk})
+            proposal_text = "".join(chunks)
+            return {"proposal_text": proposal_text, "current_step": "proposal_generated"}
         except Exception as e:
-            state["proposal_text"] = f"""Dear {state['client_name']},
-
-Thank you for reaching out regarding your {state['project_type']} project. We're excited about this opportunity.
-
-**Understanding Your Needs**
-Based on your inquiry, we understand you need a sophisticated solution with specific requirements including {state['requirements'][0] if state['requirements'] else 'custom functionality'}. We have experience delivering projects of this complexity and scope.
-
-**Our Approach**
-We follow a structured 5-phase development methodology:
-
-{phases_text}
-
-This phased approach ensures quality at each stage and allows for regular feedback and adjustments.
-
-**Project Investment**
-Based on our analysis, the estimated investment for your project is:
-- Total Development Hours: {state['project_plan']['total_estimated_hours']} hours
-- Complexity Level: {state['project_plan']['complexity'].upper()}
-- Cost Range: ${cost['min']:,} - ${cost['max']:,}
-- Timeline: {state.get('timeline', '8-12 weeks')}
-
-**Why This Investment**
-This budget covers comprehensive development, rigorous testing, and deployment support. We focus on delivering long-term value and ensuring your system is maintainable and scalable.
-
-**Next Steps**
-We'd like to schedule a 30-minute discovery call to:
-1. Confirm specific requirements
-2. Discuss timeline and priorities
-3. Address any questions
-4. Provide a detailed project plan
-
-Please let me know your availability for this week or next.
-
-Best regards,
-OttoMail Solutions"""
-            state["current_step"] = "proposal_fallback"
-        
-        return state
-
+            proposal_text = FALLBACK_PROPOSAL.format_map({
+                "client_name": state['client_name'],
+                "project_type": state['project_type'],
+                "first_requirement": state['requirements'][0] if state['requirements'] else 'custom functionality',
+                "phases_text": phases_text,
+                "total_hours": state['project_plan']['total_estimated_hours'],
+                "complexity": state['project_plan']['complexity'].upper(),
+                "cost_min": cost['min'],
+                "cost_max": cost['max'],
+                "timeline": state.get('timeline', '8-12 weeks')
+            })
+            return {"proposal_text": proposal_text, "current_step": "proposal_fallback"}
@@ -0,0 +1,226 @@
+"""Prompt templates shared by the agent nodes"""
+
+# Static instructions go first (sent as the system message) and stay
+# byte-identical across calls so provider prompt caching can reuse them.
+# Only the per-email details are sent in the human message.
+
+TRIAGE_SYSTEM = """Triage this email in one pass: classify it, extract the client details and draft a project plan.
+
+CLASSIFICATION RULES - Email IS VALID if:
+- Person asks about building/developing something (app, website, tool, system, etc.)
+- Person asks for consulting, training, or professional services
+- Person describes a business problem needing a solution
+- Message is reasonably detailed (not one-word spam)
+
+Email IS NOT VALID if:
+- It's spam, promotional, or recruiting
+- It's a job application
+- It's generic "I'll pay you big money" with no details
+- It's obviously auto-generated marketing
+
+EXTRACTION GUIDELINES:
+- client_name: Look for signature, name mentions, or parse from email address
+- company: Business name if mentioned, otherwise null or infer from domain
+- project_type: What they want built (be SPECIFIC, e.g., "Custom CRM for Real Estate", not just "CRM")
+- requirements: 3-5 specific features or requirements mentioned
+- timeline: When they need it (e.g., "ASAP", "3 months", "Q1 2026")
+- budget: Any budget mentioned, or "Flexible" if not stated
+
+PLANNING GUIDELINES:
+- Generate 5 phases: Discovery, Core Dev, Frontend/UI, Testing, Deployment
+- Assign realistic duration and hours per phase
+- Each phase has 4-5 specific tasks
+- Complexity levels: simple (40-80 hrs), medium (80-120 hrs), complex (120-200 hrs)
+- For finance/portfolio projects: assume COMPLEX (160 hrs)
+- For generic/simple projects: assume MEDIUM (80 hrs)
+
+Return ONLY valid JSON. If the email is NOT VALID, set "requirements" and "project_plan" to null:
+{
+    "classification": {
+        "is_valid": true or false,
+        "confidence": 0.0 to 1.0,
+        "reason": "one sentence explanation"
+    },
+    "requirements": {
+        "client_name": "Debabrata G.",
+        "company": "Investment Firm",
+        "email": "debabrata@example.com",
+        "project_type": "AI Portfolio Management System",
+        "requirements": ["Real-time tracking", "Risk analysis", "Trading alerts"],
+        "timeline": "3 months",
+        "budget": "$15000-$25000"
+    },
+    "project_plan": {
+        "complexity": "complex",
+        "total_estimated_hours": 160,
+        "phases": [
+            {
+                "name": "Phase 1: Discovery & Requirements",
+                "duration": "1.5 weeks",
+                "hours": 20,
+                "tasks": ["Detailed requirements gathering", "Technical design", "Architecture review", "Security planning"]
+            }
+        ]
+    }
+}"""
+
+# Starts with the single-email instructions byte for byte, so both share one cached prefix
+TRIAGE_BATCH_SYSTEM = TRIAGE_SYSTEM + """
+
+BATCH MODE: The message holds several numbered emails. Triage each of them as described above and return ONLY a JSON object of the form {"results": [...]} holding one triage object per email, in the same order as the emails. Each triage object also carries "email_index": the number i from that email's "--- Email i of N ---" header."""
+
+CLASSIFY_SYSTEM = """Classify if this email is a genuine business inquiry needing a proposal.
+
+RULES - Email IS VALID if:
+- Person asks about building/developing something (app, website, tool, system, etc.)
+- Person asks for consulting, training, or professional services
+- Person describes a business problem needing a solution
+- Message is reasonably detailed (not one-word spam)
+
+Rules - Email IS NOT VALID if:
+- It's spam, promotional, or recruiting
+- It's a job application
+- It's generic "I'll pay you big money" with no details
+- It's obviously auto-generated marketing
+
+Return ONLY valid JSON:
+{
+    "is_valid": true or false,
+    "confidence": 0.0 to 1.0,
+    "reason": "one sentence explanation"
+}"""
+
+EXTRACT_SYSTEM = """Extract structured information from this inquiry email.
+
+EXTRACTION GUIDELINES:
+- client_name: Look for signature, name mentions, or parse from email address
+- company: Business name if mentioned, otherwise null or infer from domain
+- project_type: What they want built (be SPECIFIC, e.g., "Custom CRM for Real Estate", not just "CRM")
+- requirements: 3-5 specific features or requirements mentioned
+- timeline: When they need it (e.g., "ASAP", "3 months", "Q1 2026")
+- budget: Any budget mentioned, or "Flexible" if not stated
+
+EXAMPLE OUTPUT:
+{
+    "client_name": "Debabrata G.",
+    "company": "Investment Firm",
+    "email": "debabrata@example.com",
+    "project_type": "AI Portfolio Management System",
+    "requirements": ["Real-time tracking", "Risk analysis", "Trading alerts"],
+    "timeline": "3 months",
+    "budget": "$15000-$25000"
+}
+
+Return ONLY valid JSON with extracted data."""
+
+PLAN_SYSTEM = """Create a realistic project plan for this inquiry.
+
+PLANNING GUIDELINES:
+- Generate 5 phases: Discovery, Core Dev, Frontend/UI, Testing, Deployment
+- Assign realistic duration and hours per phase
+- Each phase has 4-5 specific tasks
+- Complexity levels: simple (40-80 hrs), medium (80-120 hrs), complex (120-200 hrs)
+- For finance/portfolio projects: assume COMPLEX (160 hrs)
+- For generic/simple projects: assume MEDIUM (80 hrs)
+
+EXAMPLE COMPLEX PROJECT (160 hours):
+{
+    "complexity": "complex",
+    "total_estimated_hours": 160,
+    "phases": [
+        {
+            "name": "Phase 1: Discovery & Requirements",
+            "duration": "1.5 weeks",
+            "hours": 20,
+            "tasks": ["Detailed requirements gathering", "Technical design", "Architecture review", "Security planning"]
+        },
+        {
+            "name": "Phase 2: Core Backend Development",
+            "duration": "3 weeks",
+            "hours": 60,
+            "tasks": ["Database design", "API endpoints", "Authentication", "Integration services"]
+        },
+        {
+            "name": "Phase 3: Frontend & User Interface",
+            "duration": "2 weeks",
+            "hours": 40,
+            "tasks": ["UI/UX design", "React components", "State management", "Responsive design"]
+        },
+        {
+            "name": "Phase 4: Testing & Quality Assurance",
+            "duration": "1.5 weeks",
+            "hours": 25,
+            "tasks": ["Unit tests", "Integration tests", "Performance testing", "Security audit"]
+        },
+        {
+            "name": "Phase 5: Deployment & Handoff",
+            "duration": "1 week",
+            "hours": 15,
+            "tasks": ["Production setup", "Documentation", "Staff training", "Support plan"]
+        }
+    ]
+}
+
+Return ONLY valid JSON with project plan."""
+
+PROPOSAL_SYSTEM = """Write a professional, personalized proposal email body (NO email headers, NO subject line).
+
+CRITICAL REQUIREMENTS:
+- Address the client by their ACTUAL name from the client details
+- Sign with "OttoMail Solutions Team" (NO placeholders like [Your Name])
+- Use proper paragraph breaks (double newlines between sections)
+- DO NOT use placeholders like [Company Name] or [Your Name] - use actual values
+- Be specific about the project type from the client details
+
+PROPOSAL STRUCTURE:
+1. Greeting: Address the client personally by name
+2. Understanding: Show you understand their project needs
+3. Approach: Your methodology and why it works
+4. Project Breakdown: Summarize the 5 phases with clear formatting
+5. Investment: The cost range from the business terms and what's included
+6. Business Value: Why this is worth the investment
+7. Next Steps: Clear call-to-action (schedule call, etc.)
+8. Sign-off: "Best regards,\nOttoMail Solutions Team"
+
+TONE: Professional, confident, business-focused (not salesy)
+LENGTH: 400-600 words
+FORMATTING: Use double line breaks between sections for readability
+
+Return ONLY the email body text (no JSON, no markdown formatting, just plain text with line breaks)."""
+
+# Used when the proposal LLM call fails; filled with format_map
+FALLBACK_PROPOSAL = """Dear {client_name},
+
+Thank you for reaching out regarding your {project_type} project. We're excited about this opportunity.
+
+**Understanding Your Needs**
+Based on your inquiry, we understand you need a sophisticated solution with specific requirements including {first_requirement}. We have experience delivering projects of this complexity and scope.
+
+**Our Approach**
+We follow a structured 5-phase development methodology:
+
+{phases_text}
+
+This phased approach ensures quality at each stage and allows for regular feedback and adjustments.
+
+**Project Investment**
+Based on our analysis, the estimated investment for your project is:
+- Total Development Hours: {total_hours} hours
+- Complexity Level: {complexity}
+- Cost Range: ${cost_min:,} - ${cost_max:,}
+- Timeline: {timeline}
+
+**Why This Investment**
+This budget covers comprehensive development, rigorous testing, and deployment support. We focus on delivering long-term value and ensuring your system is maintainable and scalable.
+
+**Next Steps**
+We'd like to schedule a 30-minute discovery call to:
+1. Confirm specific requirements
+2. Discuss timeline and priorities
+3. Address any questions
+4. Provide a detailed project plan
+
+Please let me know your availability for this week or next.
+
+Best regards,
+OttoMail Solutions"""
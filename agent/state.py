@@ -29,6 +29,7 @@ class EmailAgentState(TypedDict):
     # Control flags
     is_valid_inquiry: bool
     confidence_score: float
+    classification_reason: Optional[str]
     needs_human_review: bool
     current_step: str
     error: Optional[str]
@@ -1,8 +1,9 @@
 """API routes"""
+import asyncio
 from fastapi import APIRouter, HTTPException
 from integrations.standard_email import StandardEmailService
 from integrations.storage import StorageService
-from agent.graph import EmailAgentGraph
+from agent.graph import EmailAgentGraph, get_checkpointer
 from integrations.llm_wrapper import UnifiedLLM
 from app.schemas import ProposalSchema, ApprovalRequest
 
@@ -14,41 +15,61 @@ async def check_emails():
     try:
         gmail = StandardEmailService()
         llm = UnifiedLLM()
-        agent = EmailAgentGraph(llm)
+        agent = EmailAgentGraph(llm, checkpointer=await get_checkpointer())
         storage = StorageService()
         
         emails = await gmail.get_unread_emails()
-        results = []
         
+        # StorageService is synchronous SQLAlchemy; keep its queries off the event loop
+        processed = await asyncio.to_thread(storage.processed_email_ids, [email["id"] for email in emails])
+        pending = []
         for email in emails:
+            # Skip processed emails
+            if email["id"] in processed:
+                print(f"[DEBUG] Skipping already processed email: {email['id']}")
+                continue
+            pending.append(email)
+        
+        # Each email runs through the graph on its own; the LLM calls overlap
+        states = await asyncio.gather(
+            *(agent.process_email(email) for email in pending),
+            return_exceptions=True
+        )
+        
+        # Marked read together once the run is done, instead of one round-trip each
+        read_ids = []
+        
+        async def draft_reply(email, state):
             try:
-                # Skip processed emails
-                if storage.is_email_processed(email["id"]):
-                    print(f"[DEBUG] Skipping already processed email: {email['id']}")
-                    continue
-                    
-                state = await agent.process_email(email)
-                
+                if isinstance(state, Exception):
+                    raise state
                 if not state["is_valid_inquiry"]:
-                    await gmail.mark_as_read(email["id"])
-                    continue
+                    read_ids.append(email["id"])
+                    return None
                 
-                # Save to database
-                client_id = storage.create_client(state)
                 draft_id = await gmail.create_draft(
                     to=state["email_from"],
                     subject=f"{state['project_type']} Proposal",
                     body=state["proposal_text"],
                     thread_id=state["thread_id"]
                 )
-                proposal_id = storage.create_proposal(client_id, state, draft_id)
-                
-                await gmail.mark_as_read(email["id"])
-                results.append({"proposal_id": proposal_id, "status": "success"})
+                return state, draft_id
             except Exception as e:
                 print(f"[ERROR] Failed to process email {email.get('id', 'unknown')}: {e}")
                 # Continue processing other emails even if one fails
-                continue
+                return None
+        
+        drafted = await asyncio.gather(*(draft_reply(e, s) for e, s in zip(pending, states)))
+        records = [record for record in drafted if record]
+        
+        # One transaction for every client + proposal in the batch
+        proposal_ids = await asyncio.to_thread(storage.save_proposals, records) if records else []
+        saved = [(state, pid) for (state, _), pid in zip(records, proposal_ids) if pid is not None]
+        read_ids.extend(state["email_id"] for state, _ in saved)
+        await gmail.mark_many_as_read(read_ids)
+        # Finished with for good, so their checkpoints only take up space
+        await agent.forget_emails(email for email in pending if email["id"] in read_ids)
+        results = [{"proposal_id": pid, "status": "success"} for _, pid in saved]
         
         return {"processed": len(results)}
     except Exception as e:
@@ -59,32 +80,38 @@ async def check_emails():
 @router.get("/proposals/pending")
 async def get_pending_proposals():
     storage = StorageService()
-    proposals = storage.get_pending_proposals()
+    proposals = await asyncio.to_thread(storage.get_pending_proposals)
     return proposals
 
+@router.get("/proposals/{proposal_id}")
+async def get_proposal_detail(proposal_id: int):
+    storage = StorageService()
+    proposal = await asyncio.to_thread(storage.get_proposal_detail, proposal_id)
+    if not proposal:
+        raise HTTPException(404, "Proposal not found")
+    return proposal
+
 @router.post("/proposals/{proposal_id}/approve")
 async def approve_proposal(proposal_id: int, request: ApprovalRequest):
     storage = StorageService()
     gmail = StandardEmailService()
     
-    proposal = storage.get_proposal(proposal_id)
+    # Plain dict with the client's address and this inquiry's project, so nothing expires on commit
+    proposal = await asyncio.to_thread(storage.get_proposal_detail, proposal_id)
     if not proposal:
         raise HTTPException(404, "Proposal not found")
     
     if request.approved:
-        storage.approve_proposal(proposal_id)
+        await asyncio.to_thread(storage.approve_proposal, proposal_id)
         
-        # Fetch client to get email address
-        client = storage.get_client(proposal.client_id)
-        if client:
-            await gmail.send_email(
-                to=client.email,
-                subject=f"Proposal for {client.project_type}",
-                body=proposal.proposal_text
-            )
+        await gmail.send_email(
+            to=proposal["client_email"],
+            subject=f"Proposal for {proposal['project_type']}",
+            body=proposal["proposal_text"]
+        )
             
-        storage.mark_sent(proposal_id)
+        await asyncio.to_thread(storage.mark_sent, proposal_id)
         return {"message": "Proposal approved and sent!"}
     else:
-        storage.reject_proposal(proposal_id)
+        await asyncio.to_thread(storage.reject_proposal, proposal_id)
         return {"message": "Proposal rejected"}
@@ -1,5 +1,5 @@
 """Database models"""
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, create_engine
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, Index, create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -19,13 +19,27 @@ class Client(Base):
     budget = Column(String(100))
     status = Column(String(50), default="new")
     thread_id = Column(String(255))
-    email_id = Column(String(255), unique=True)  # Gmail message ID for deduplication
+    email_id = Column(String(255), unique=True)  # Dedup for rows written before the inquiries table
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Inquiry(Base):
+    """One row per processed email: what was asked, and which proposal answered it"""
+    __tablename__ = "inquiries"
+    id = Column(Integer, primary_key=True)
+    client_id = Column(Integer, index=True)
+    proposal_id = Column(Integer, unique=True)
+    email_id = Column(String(255), unique=True)  # Message ID for deduplication
+    project_type = Column(String(255))
+    requirements = Column(Text)
+    timeline = Column(String(100))
+    budget = Column(String(100))
+    thread_id = Column(String(255))
     created_at = Column(DateTime, default=datetime.utcnow)
 
 class Proposal(Base):
     __tablename__ = "proposals"
     id = Column(Integer, primary_key=True)
-    client_id = Column(Integer)
+    client_id = Column(Integer, index=True)
     proposal_text = Column(Text)
     cost_min = Column(Integer)
     cost_max = Column(Integer)
@@ -34,9 +48,25 @@ class Proposal(Base):
     approved = Column(Boolean, default=False)
     sent_at = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Partial index: the review queue only ever scans pending rows, newest first
+        Index("ix_proposals_pending_created", created_at.desc(), sqlite_where=status == "pending"),
+    )
 
 engine = create_engine("sqlite:///./copilot.db")
 SessionLocal = sessionmaker(bind=engine)
 
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _):
+    # WAL lets readers run alongside the writer; NORMAL syncs once per checkpoint, not per commit
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 def init_db():
     Base.metadata.create_all(engine)
+    # create_all skips existing tables, so add indexes introduced after the first run
+    for index in Proposal.__table__.indexes:
+        index.create(engine, checkfirst=True)
@@ -1,15 +1,19 @@
 import sqlite3
-from app.models import Proposal, Client
 
 conn = sqlite3.connect("copilot.db")
-c = conn.cursor()
+conn.execute("PRAGMA journal_mode=WAL")
 
+# Iterate the cursor so rows stream instead of being materialised with fetchall()
 print("CLIENTS:")
-c.execute("SELECT * FROM clients")
-print(c.fetchall())
+for row in conn.execute("SELECT * FROM clients"):
+    print(row)
+
+print("\nINQUIRIES:")
+for row in conn.execute("SELECT * FROM inquiries"):
+    print(row)
 
 print("\nPROPOSALS:")
-c.execute("SELECT * FROM proposals")
-print(c.fetchall())
+for row in conn.execute("SELECT * FROM proposals"):
+    print(row)
 
 conn.close()
@@ -1,41 +1,40 @@
 #!/usr/bin/env python3
 """Check if system is ready to test with real HuggingFace + Gmail"""
 import os
-from dotenv import load_dotenv
+from typing import Callable, Dict, Optional
+from dotenv import dotenv_values
 
-load_dotenv()
+KEYS = ("EMAIL_USER", "EMAIL_PASSWORD", "HUGGINGFACE_API_KEY", "HUGGINGFACE_MODEL", "LLM_PROVIDER")
+
+# Read everything once; real environment variables win over .env, as with load_dotenv()
+dotenv_file = dotenv_values(".env")
+env = {key: os.environ.get(key, dotenv_file.get(key)) for key in KEYS}
+
+SET = "✓ SET"
+MISSING = "✗ MISSING"
+PLACEHOLDER = "⏳ PLACEHOLDER"
+
+def _is_set(value: Optional[str]) -> str:
+    return SET if value else MISSING
+
+# Keys with a recognisable placeholder; everything else only needs a value
+VALIDATORS: Dict[str, Callable[[Optional[str]], str]] = {
+    "EMAIL_PASSWORD": lambda v: PLACEHOLDER if v and "xxxx" in v else _is_set(v),
+    "HUGGINGFACE_API_KEY": lambda v: PLACEHOLDER if v and not v.startswith("hf_") else _is_set(v),
+}
 
 print("=" * 80)
 print("SYSTEM READINESS CHECK")
 print("=" * 80)
 
-checks = {
-    "EMAIL_USER": os.getenv("EMAIL_USER"),
-    "EMAIL_PASSWORD": os.getenv("EMAIL_PASSWORD"),
-    "HUGGINGFACE_API_KEY": os.getenv("HUGGINGFACE_API_KEY"),
-    "HUGGINGFACE_MODEL": os.getenv("HUGGINGFACE_MODEL"),
-    "LLM_PROVIDER": os.getenv("LLM_PROVIDER"),
-}
-
 print("\nCurrent Configuration:")
 print("-" * 80)
 
 all_ready = True
-for key, value in checks.items():
-    if not value:
-        status = "✗ MISSING"
+for key, value in env.items():
+    status = VALIDATORS.get(key, _is_set)(value)
+    if status != SET:
         all_ready = False
-    elif "xxxx" in str(value) or "hf_" not in str(value) and key == "HUGGINGFACE_API_KEY":
-        if key == "EMAIL_PASSWORD" and "xxxx" in str(value):
-            status = "⏳ PLACEHOLDER"
-            all_ready = False
-        elif key == "HUGGINGFACE_API_KEY" and "hf_" not in str(value):
-            status = "⏳ PLACEHOLDER"
-            all_ready = False
-        else:
-            status = "✓ SET"
-    else:
-        status = "✓ SET"
     
     # Mask sensitive values
     display_value = value
@@ -47,10 +46,11 @@ for key, value in checks.items():
 
 print("\n" + "=" * 80)
 
-if all_ready or (os.getenv("LLM_PROVIDER") == "mock"):
+is_mock = env["LLM_PROVIDER"] == "mock"
+if all_ready or is_mock:
     print("✓ SYSTEM READY TO TEST")
     print("=" * 80)
-    if os.getenv("LLM_PROVIDER") == "mock":
+    if is_mock:
         print("\nCurrently using MOCK provider (for testing without credentials)")
         print("To test with REAL HuggingFace:")
         print("  1. Get Gmail app password (https://myaccount.google.com/security)")
@@ -65,16 +65,16 @@ else:
     print("=" * 80)
     print("\nTo enable real HuggingFace + Gmail testing:")
     
-    if EMAIL_PASSWORD := os.getenv("EMAIL_PASSWORD"):
-        if "xxxx" in EMAIL_PASSWORD:
+    if env["EMAIL_PASSWORD"]:
+        if "xxxx" in env["EMAIL_PASSWORD"]:
             print("  1. [ ] Get Gmail app password")
             print("        https://myaccount.google.com/security")
             print("        Select: Mail + Windows device")
             print("        Copy: 16-char password (xxxx xxxx xxxx xxxx)")
             print("        Add to .env: EMAIL_PASSWORD=xxxx xxxx xxxx xxxx")
     
-    if HFKEY := os.getenv("HUGGINGFACE_API_KEY"):
-        if "hf_" not in HFKEY:
+    if env["HUGGINGFACE_API_KEY"]:
+        if not env["HUGGINGFACE_API_KEY"].startswith("hf_"):
             print("  2. [ ] Get HuggingFace token")
             print("        https://huggingface.co/settings/tokens")
             print("        Click: New token")
@@ -0,0 +1,32 @@
+"""Application settings shared by the integrations"""
+from functools import lru_cache
+from typing import Literal
+from pydantic_settings import BaseSettings
+
+class AppSettings(BaseSettings):
+    # LLM providers
+    LLM_PROVIDER: Literal["local", "gemini", "mock", "openai"] = "mock"
+    GOOGLE_API_KEY: str = ""
+    OPENAI_API_KEY: str = ""
+    LLM_MODEL: str = "gpt-4o-mini"
+    LLM_MODEL_PATH: str = "Meta-Llama-3-8B-Instruct.Q4_0.gguf"
+    LLM_DEVICE: str = "gpu"  # Explicitly use GPU
+    LLM_CACHE: bool = True  # Memoize identical prompts; set LLM_CACHE=0 to disable
+    LLM_SEMANTIC_CACHE: bool = False  # Reuse classifications for near-duplicate emails; needs sentence-transformers
+    LLM_SEMANTIC_THRESHOLD: float = 0.92  # Minimum cosine similarity for a semantic cache hit
+    
+    # IMAP/SMTP
+    EMAIL_USER: str = ""
+    EMAIL_PASSWORD: str = ""
+    IMAP_SERVER: str = "imap.gmail.com"
+    SMTP_SERVER: str = "smtp.gmail.com"
+    SMTP_PORT: int = 465
+
+    class Config:
+        env_file = ".env"
+        extra = "ignore"
+
+@lru_cache(maxsize=1)
+def settings() -> AppSettings:
+    """Environment and .env are read once per process, on first use"""
+    return AppSettings()
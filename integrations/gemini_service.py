@@ -1,41 +1,93 @@
+from typing import AsyncIterator, Dict, Final, Optional, Type, Union
+from langchain_core.messages import SystemMessage, HumanMessage
+from google.api_core.exceptions import GoogleAPIError
 from langchain_google_genai import ChatGoogleGenerativeAI
-from pydantic_settings import BaseSettings
+from langchain_google_genai.chat_models import ChatGoogleGenerativeAIError
+from pydantic import BaseModel
+from integrations._settings import settings
+from integrations.llm_cache import FallbackResponse
 
-class GeminiConfig(BaseSettings):
-    GOOGLE_API_KEY: str = ""
-    
-    class Config:
-        env_file = ".env"
-        extra = "ignore"
+# Canned replies for when the Gemini API call fails, built once at import
+_FALLBACK_CLASSIFY: Final = FallbackResponse('{"is_valid": true, "confidence": 0.5, "reason": "Fallback: Gemini API Error"}')
+_FALLBACK_PLAN: Final = FallbackResponse('{"complexity": "low","total_estimated_hours": 10,"phases": [{"name": "Phase 1","duration": "1 week","hours": 10,"tasks": ["Initial Consultation"]}]}')
+_FALLBACK_PROPOSAL: Final = FallbackResponse("Dear Client,\n\nThank you for your email. We are currently experiencing high demand on our AI servers. Please contact us directly to discuss your project.\n\nBest regards,\nOttoMail (Fallback Mode)")
+_FALLBACK_GENERIC: Final = FallbackResponse('{"response": "Error in Gemini API"}')
 
-config = GeminiConfig()
+# API and transport failures; malformed structured output (ValueError) is not among them
+_PROVIDER_ERRORS: Final = (GoogleAPIError, ChatGoogleGenerativeAIError, ConnectionError, TimeoutError)
 
 class GeminiService:
     def __init__(self):
-        if not config.GOOGLE_API_KEY:
+        api_key = settings().GOOGLE_API_KEY
+        if not api_key:
             raise ValueError("GOOGLE_API_KEY is required for Gemini Service")
             
         self.llm = ChatGoogleGenerativeAI(
             model="gemini-2.5-flash",
-            google_api_key=config.GOOGLE_API_KEY,
+            google_api_key=api_key,
             temperature=0.3
         )
+        # with_structured_output converts the schema to a tool spec; build it once per model
+        self._structured: Dict[Type[BaseModel], object] = {}
 
-    async def invoke(self, prompt: str) -> str:
+    def _messages(self, prompt: str, system: Optional[str] = None):
+        if system:
+            # Static system prefix first so repeated calls share a cacheable prefix
+            return [SystemMessage(content=system), HumanMessage(content=prompt)]
+        return prompt
+
+    async def invoke(self, prompt: str, system: Optional[str] = None) -> str:
         """Invoke Gemini LLM and return response text"""
         try:
-            response = await self.llm.ainvoke(prompt)
+            response = await self.llm.ainvoke(self._messages(prompt, system))
             return response.content
         except Exception as e:
-            print(f"[Gemini Error] Fallback triggered: {e}")
-            # For extraction prompts, raise the exception so nodes.py can handle intelligent fallback
-            if "Extract structured information" in prompt:
-                raise  # Let nodes.py handle the intelligent name parsing fallback
-            # Check prompt type to return valid JSON for other cases
-            elif "Classify if this email" in prompt:
-                return '{"is_valid": true, "confidence": 0.5, "reason": "Fallback: Gemini API Error"}'
-            elif "Create a realistic project plan" in prompt:
-                return '{"complexity": "low","total_estimated_hours": 10,"phases": [{"name": "Phase 1","duration": "1 week","hours": 10,"tasks": ["Initial Consultation"]}]}'
-            elif "Write a professional" in prompt:
-                return f"Dear Client,\\n\\nThank you for your email. We are currently experiencing high demand on our AI servers. Please contact us directly to discuss your project.\\n\\nBest regards,\\nOttoMail (Fallback Mode)"
-            return '{"response": "Error in Gemini API"}'
+            return self._fallback(prompt, system, e)
+
+    async def stream(self, prompt: str, system: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream Gemini response text as it is generated"""
+        started = False
+        try:
+            async for chunk in self.llm.astream(self._messages(prompt, system)):
+                if chunk.content:
+                    started = True
+                    yield chunk.content
+        except Exception as e:
+            # A partial reply can't be patched with canned text
+            if started:
+                raise
+            yield self._fallback(prompt, system, e)
+
+    def _fallback(self, prompt: str, system: Optional[str], error: Exception) -> str:
+        print(f"[Gemini Error] Fallback triggered: {error}")
+        if system:
+            prompt = f"{system}\n\n{prompt}"
+        # For extraction prompts, raise the exception so nodes.py can handle intelligent fallback
+        if "Extract structured information" in prompt:
+            raise error  # Let nodes.py handle the intelligent name parsing fallback
+        # Check prompt type to return valid JSON for other cases
+        elif "Classify if this email" in prompt:
+            return _FALLBACK_CLASSIFY
+        elif "Create a realistic project plan" in prompt:
+            return _FALLBACK_PLAN
+        elif "Write a professional" in prompt:
+            return _FALLBACK_PROPOSAL
+        return _FALLBACK_GENERIC
+
+    async def invoke_json(self, prompt: str, schema: Type[BaseModel], system: Optional[str] = None) -> Union[BaseModel, str]:
+        """Invoke Gemini with structured output; API outages return the canned JSON reply as text"""
+        structured = self._structured.get(schema)
+        if structured is None:
+            structured = self._structured[schema] = self.llm.with_structured_output(schema)
+        try:
+            result = await structured.ainvoke(self._messages(prompt, system))
+        except _PROVIDER_ERRORS as e:
+            # Parse and validation errors propagate so the node retries with a hint instead
+            fallback = self._fallback(prompt, system, e)
+            if fallback is _FALLBACK_GENERIC:
+                # No canned reply fits this schema (e.g. triage); the node falls back per step
+                raise
+            return fallback
+        if result is None:
+            raise ValueError("Gemini returned no structured output")
+        return result
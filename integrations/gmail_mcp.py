@@ -1,78 +1,204 @@
 """Gmail MCP integration"""
+import asyncio
 import os
 import base64
-import pickle
-from email.mime.text import MIMEText
+import codecs
+import html
+import json
+import re
+import threading
+from email import policy
+from email.message import EmailMessage
+import httplib2
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 
+# Partial-response masks: only the parts of a message we actually read
+_LIST_FIELDS = 'messages/id'
+# Four levels of parts covers mixed > related > alternative > text
+_PART_FIELDS = 'mimeType,body/data'
+for _ in range(4):
+    _PART_FIELDS = f'mimeType,body/data,parts({_PART_FIELDS})'
+_FULL_FIELDS = f'id,threadId,payload(headers,{_PART_FIELDS})'
+_METADATA_FIELDS = 'id,threadId,payload/headers'
+# users.messages.batchModify accepts at most this many ids per call
+_BATCH_MODIFY_LIMIT = 1000
+
+# Parts larger than this are decoded in chunks instead of one full bytes copy
+_STREAM_DECODE_THRESHOLD = 64_000
+_DECODE_CHUNK = 8192  # Multiple of 4, so chunks split cleanly on base64 quanta
+
+_HTML_DROP_RE = re.compile(r'<(script|style)\b.*?</\1>', re.S | re.I)
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+
+def _decode_data(data):
+    """Decode a Gmail base64url body"""
+    if len(data) <= _STREAM_DECODE_THRESHOLD:
+        return base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pieces = []
+    for start in range(0, len(data), _DECODE_CHUNK):
+        chunk = data[start:start + _DECODE_CHUNK]
+        chunk += '=' * (-len(chunk) % 4)
+        pieces.append(decoder.decode(base64.urlsafe_b64decode(chunk)))
+    pieces.append(decoder.decode(b'', final=True))
+    return ''.join(pieces)
+
+def _strip_html(text):
+    text = _HTML_DROP_RE.sub('', text)
+    text = html.unescape(_HTML_TAG_RE.sub('', text))
+    return _BLANK_LINES_RE.sub('\n\n', text).strip()
+
+def _find_part(payload, mime_type):
+    """Depth-first search for the first part of `mime_type` that carries data"""
+    if payload.get('mimeType') == mime_type and 'data' in payload.get('body', {}):
+        return payload
+    for part in payload.get('parts', []):
+        found = _find_part(part, mime_type)
+        if found:
+            return found
+    return None
+
+# Authenticated once per process and shared by every GmailMCP instance
+_SERVICE = None
+_CREDS = None
+_SERVICE_LOCK = threading.Lock()
+
+def _authenticate():
+    creds_file = "credentials.json"
+    token_file = "token.json"
+    
+    creds = None
+    if os.path.exists(token_file):
+        try:
+            with open(token_file) as f:
+                creds = Credentials.from_authorized_user_info(json.load(f), SCOPES)
+        except ValueError as e:
+            # Unreadable or legacy pickled token: fall through to a fresh login
+            print(f"[ERROR] Ignoring unreadable {token_file}: {e}")
+    
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(creds_file, SCOPES)
+            creds = flow.run_local_server(port=0)
+        
+        with open(token_file, 'w') as f:
+            f.write(creds.to_json())
+    
+    return creds
+
+def _get_service():
+    global _SERVICE, _CREDS
+    with _SERVICE_LOCK:
+        if _SERVICE is None:
+            _CREDS = _authenticate()
+            # Use the discovery document bundled with google-api-python-client; never fetch it
+            _SERVICE = build('gmail', 'v1', credentials=_CREDS, static_discovery=True)
+        return _SERVICE, _CREDS
+
 class GmailMCP:
     def __init__(self):
-        self.service = self._authenticate()
+        self.service, self.creds = _get_service()
+        self._local = threading.local()
     
-    def _authenticate(self):
-        creds_file = "credentials.json"
-        token_file = "token.json"
-        
-        creds = None
-        if os.path.exists(token_file):
-            with open(token_file, 'rb') as f:
-                creds = pickle.load(f)
-        
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(creds_file, SCOPES)
-                creds = flow.run_local_server(port=0)
-            
-            with open(token_file, 'wb') as f:
-                pickle.dump(creds, f)
-        
-        return build('gmail', 'v1', credentials=creds)
+    def _http(self):
+        # httplib2.Http is not thread-safe, so each worker thread gets its own
+        # authorized connection (kept alive across calls) and requests can overlap
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = AuthorizedHttp(self.creds, http=httplib2.Http())
+        return http
     
-    async def get_unread_emails(self, max_results=5):
+    async def get_unread_emails(self, max_results=5, metadata_only=False):
+        """Unread inbox messages; `metadata_only` skips bodies (From/Subject/Date headers only)"""
+        return await self.list_emails('is:unread in:inbox', max_results, metadata_only)
+    
+    async def list_emails(self, query, max_results=5, metadata_only=False):
+        """Newest messages matching a Gmail search query"""
+        # googleapiclient is blocking; keep it off the event loop
+        return await asyncio.to_thread(self._list_emails_blocking, query, max_results, metadata_only)
+    
+    def _list_emails_blocking(self, query, max_results, metadata_only=False):
         results = self.service.users().messages().list(
             userId='me',
-            q='is:unread in:inbox',
-            maxResults=max_results
-        ).execute()
+            q=query,
+            maxResults=max_results,
+            fields=_LIST_FIELDS
+        ).execute(http=self._http())
+        messages = results.get('messages', [])
+        if not messages:
+            return []
+        
+        # One batched HTTP request for all messages instead of a round-trip each
+        fetched = {}
+        def collect(request_id, response, exception):
+            if exception is not None:
+                print(f"[ERROR] Failed to fetch message {request_id}: {exception}")
+                return
+            fetched[request_id] = self._parse_message(response)
         
-        emails = []
-        for msg in results.get('messages', []):
-            email = self._get_email_details(msg['id'])
-            emails.append(email)
-        return emails
+        batch = self.service.new_batch_http_request(callback=collect)
+        for msg in messages:
+            batch.add(self._get_request(msg['id'], metadata_only), request_id=msg['id'])
+        batch.execute(http=self._http())
+        
+        # Batch callbacks may arrive in any order; keep the inbox order
+        return [fetched[msg['id']] for msg in messages if msg['id'] in fetched]
+    
+    def _get_request(self, msg_id, metadata_only=False):
+        if metadata_only:
+            return self.service.users().messages().get(
+                userId='me', id=msg_id, format='metadata',
+                metadataHeaders=['From', 'Subject', 'Date'], fields=_METADATA_FIELDS
+            )
+        return self.service.users().messages().get(userId='me', id=msg_id, format='full', fields=_FULL_FIELDS)
     
     def _get_email_details(self, msg_id):
-        msg = self.service.users().messages().get(
-            userId='me', id=msg_id, format='full'
-        ).execute()
-        
+        return self._parse_message(self._get_request(msg_id).execute(http=self._http()))
+    
+    def _parse_message(self, msg):
         headers = {h['name']: h['value'] for h in msg['payload']['headers']}
         body = self._extract_body(msg['payload'])
         
         return {
-            'id': msg_id,
+            'id': msg['id'],
             'from': headers.get('From', ''),
             'subject': headers.get('Subject', ''),
+            'date': headers.get('Date', ''),
             'body': body,
             'thread_id': msg['threadId']
         }
     
     def _extract_body(self, payload):
-        if 'body' in payload and 'data' in payload['body']:
-            return base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
+        # Prefer plain text anywhere in the tree, then HTML with the markup stripped
+        part = _find_part(payload, 'text/plain')
+        if part:
+            return _decode_data(part['body']['data'])
+        part = _find_part(payload, 'text/html')
+        if part:
+            return _strip_html(_decode_data(part['body']['data']))
+        # Single-part message of another type
+        if 'data' in payload.get('body', {}):
+            return _decode_data(payload['body']['data'])
         return ""
     
     async def create_draft(self, to, subject, body, thread_id=None):
-        message = MIMEText(body)
+        return await asyncio.to_thread(self._create_draft_blocking, to, subject, body, thread_id)
+    
+    def _create_draft_blocking(self, to, subject, body, thread_id):
+        # SMTP policy: RFC-compliant CRLF output, non-ASCII headers still encoded
+        message = EmailMessage(policy=policy.SMTP)
         message['to'] = to
         message['subject'] = subject
+        message.set_content(body)
         
         raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
         draft_body = {'message': {'raw': raw}}
@@ -81,15 +207,26 @@ class GmailMCP:
         
         draft = self.service.users().drafts().create(
             userId='me', body=draft_body
-        ).execute()
+        ).execute(http=self._http())
         return draft['id']
     
     async def send_draft(self, draft_id):
-        self.service.users().drafts().send(userId='me', body={'id': draft_id}).execute()
+        request = self.service.users().drafts().send(userId='me', body={'id': draft_id})
+        await asyncio.to_thread(lambda: request.execute(http=self._http()))
     
     async def mark_as_read(self, msg_id):
-        self.service.users().messages().modify(
+        request = self.service.users().messages().modify(
             userId='me',
             id=msg_id,
             body={'removeLabelIds': ['UNREAD']}
-        ).execute()
+        )
+        await asyncio.to_thread(lambda: request.execute(http=self._http()))
+    
+    async def mark_many_as_read(self, msg_ids):
+        """Strip UNREAD from many messages with one batchModify call per 1000 ids"""
+        for start in range(0, len(msg_ids), _BATCH_MODIFY_LIMIT):
+            request = self.service.users().messages().batchModify(
+                userId='me',
+                body={'ids': msg_ids[start:start + _BATCH_MODIFY_LIMIT], 'removeLabelIds': ['UNREAD']}
+            )
+            await asyncio.to_thread(lambda: request.execute(http=self._http()))
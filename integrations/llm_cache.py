@@ -0,0 +1,48 @@
+"""In-process cache for LLM responses"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+
+class FallbackResponse(str):
+    """Canned text returned when a provider call failed; never cached"""
+
+
+class ResponseCache:
+    """Exact-match LRU response cache keyed on a BLAKE2b digest of the normalized request"""
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 256, enabled: bool = True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        # Least recently used first
+        self._entries: "OrderedDict[bytes, Tuple[float, Any]]" = OrderedDict()
+
+    @staticmethod
+    def key(model: str, prompt: str, system: Optional[str] = None, schema: Optional[str] = None) -> bytes:
+        # Whitespace-only differences (re-wrapped or re-indented emails) map to the same entry
+        payload = {"model": model, "system": system, "prompt": " ".join(prompt.split()), "schema": schema}
+        return hashlib.blake2b(json.dumps(payload, sort_keys=True).encode(), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: bytes, value: Any):
+        if not self.enabled or value is None or isinstance(value, FallbackResponse):
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -1,23 +1,49 @@
-from pydantic_settings import BaseSettings
-from typing import Literal, Optional
+import asyncio
+import re
+from pydantic import BaseModel
+from typing import AsyncIterator, Final, Optional, Type, TypeVar
 from integrations.local_llm import LocalLLMService
 from integrations.gemini_service import GeminiService
+from integrations.openai_service import LLMService
+from integrations.llm_cache import FallbackResponse, ResponseCache
+from integrations.semantic_cache import SemanticCache
+from integrations._settings import settings
 
-class LLMConfig(BaseSettings):
-    LLM_PROVIDER: Literal["local", "gemini", "mock"] = "mock"
-    
-    class Config:
-        env_file = ".env"
-        extra = "ignore"
+T = TypeVar("T", bound=BaseModel)
+
+# Schemas whose replies carry no client data, so a near-duplicate email may reuse them.
+# Proposals, extraction and triage output name the sender and their prices, and never qualify.
+_SEMANTIC_SCHEMAS: Final = frozenset({"Classification"})
 
-config = LLMConfig()
+def clean_json(response: str) -> str:
+    """Clean markdown formatting from JSON response"""
+    response = response.strip()
+    # Fast path: a bare JSON object needs no fence stripping
+    if response and response[0] == '{' and response[-1] == '}':
+        return response
+    response = response.removeprefix("```json").removeprefix("```")
+    return response.removesuffix("```").strip()
 
 class UnifiedLLM:
+    """Process-wide singleton: providers and the response cache are built once"""
     _instance = None
 
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
     def __init__(self):
+        if getattr(self, "_initialized", False):
+            return
+        self._initialized = True
+        config = settings()
         self.provider = config.LLM_PROVIDER
         self.service = self._create_service()
+        self.cache = ResponseCache(ttl=3600, max_entries=256, enabled=config.LLM_CACHE)
+        self.semantic = SemanticCache(threshold=config.LLM_SEMANTIC_THRESHOLD, enabled=config.LLM_SEMANTIC_CACHE)
+        # Cache entries are scoped to the backend actually serving requests
+        self._model_id = type(self.service).__name__
 
     def _create_service(self):
         p = str(self.provider).strip().lower()
@@ -30,6 +56,13 @@ class UnifiedLLM:
                 print(f"Failed to init Gemini: {e}")
                 return EnhancedMockService()
         
+        if p == "openai":
+            try:
+                return LLMService()
+            except Exception as e:
+                print(f"Failed to init OpenAI: {e}")
+                return EnhancedMockService()
+        
         if p == "local":
             try:
                 return LocalLLMService()
@@ -39,35 +72,111 @@ class UnifiedLLM:
             
         return EnhancedMockService()
 
-    async def invoke(self, prompt: str) -> str:
-        return await self.service.invoke(prompt)
+    @classmethod
+    async def aclose(cls):
+        """Release the provider's connections, if the singleton was ever built"""
+        service = getattr(cls._instance, "service", None)
+        if hasattr(service, "aclose"):
+            await service.aclose()
 
+    async def _semantic_get(self, prompt: str, system: Optional[str], schema: str):
+        """(slot, cached text) from the similarity cache; slot is None when it doesn't apply"""
+        if not self.semantic.enabled or schema not in _SEMANTIC_SCHEMAS:
+            return None, None
+        # Only prompts sent with the same model, instructions and schema are compared
+        namespace = self.cache.key(self._model_id, "", system, schema=schema)
+        vector = await asyncio.to_thread(self.semantic.embed, prompt)
+        return (namespace, vector), self.semantic.get(namespace, vector)
 
-class EnhancedMockService:
-    """Context-aware mock service for testing and development"""
-    
-    async def invoke(self, prompt: str) -> str:
-        """Generate context-aware mock responses based on prompt type"""
-        print(f"[MOCK LLM]: {prompt[:60]}...")
+    async def _semantic_set(self, slot, response: str):
+        if slot is not None and not isinstance(response, FallbackResponse):
+            await asyncio.to_thread(self.semantic.set, *slot, response)
+
+    async def invoke(self, prompt: str, system: Optional[str] = None) -> str:
+        """Invoke the active provider; `system` holds static instructions sent ahead of `prompt`"""
+        key = self.cache.key(self._model_id, prompt, system)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
         
-        if "Classify if this email" in prompt or "Analyze this email" in prompt:
-            if "finance" in prompt.lower() or "portfolio" in prompt.lower():
-                return '{"is_valid": true, "confidence": 0.95, "reason": "Valid financial services inquiry"}'
-            return '{"is_valid": true, "confidence": 0.9, "reason": "Valid business inquiry"}'
+        response = await self.service.invoke(prompt, system=system)
+        self.cache.set(key, response)
+        return response
+
+    async def stream(self, prompt: str, system: Optional[str] = None) -> AsyncIterator[str]:
+        """Yield response text chunks; providers without streaming yield one chunk"""
+        key = self.cache.key(self._model_id, prompt, system)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
         
-        elif "Extract structured information" in prompt or "Extract structured client information" in prompt:
-            if "portfolio" in prompt.lower() or "finance" in prompt.lower():
-                return '{"client_name": "Debabrata G.","company": "Finance Company","email": "debabrata@financecorp.com","project_type": "AI Agent for Portfolio Management System","requirements": ["Real-time portfolio tracking","Risk analysis and alerts","Automated trading suggestions","Historical performance analytics","Integration with multiple brokers"],"timeline": "3 months","budget": "$15000-$20000"}'
-            return '{"client_name": "John Doe","company": "Tech Startup","email": "john@startup.com","project_type": "Web Application","requirements": ["React frontend","Python backend","Database","User auth","API"],"timeline": "2 months","budget": "$10000-$15000"}'
+        if not hasattr(self.service, "stream"):
+            response = await self.service.invoke(prompt, system=system)
+            self.cache.set(key, response)
+            yield response
+            return
         
-        elif "Create a realistic project plan" in prompt or "Create project breakdown" in prompt:
-            if "complex" in prompt.lower() or "portfolio" in prompt.lower():
-                return '{"complexity": "complex","total_estimated_hours": 160,"phases": [{"name": "Phase 1: Discovery & Requirements","duration": "1.5 weeks","hours": 20,"tasks": ["Detailed requirements gathering","Technical design","Architecture review","Security planning"]},{"name": "Phase 2: Core Backend Development","duration": "3 weeks","hours": 60,"tasks": ["Database design","API endpoints","Authentication","Integration services"]},{"name": "Phase 3: Frontend & User Interface","duration": "2 weeks","hours": 40,"tasks": ["UI/UX design","React components","State management","Responsive design"]},{"name": "Phase 4: Testing & Quality Assurance","duration": "1.5 weeks","hours": 25,"tasks": ["Unit tests","Integration tests","Performance testing","Security audit"]},{"name": "Phase 5: Deployment & Handoff","duration": "1 week","hours": 15,"tasks": ["Production setup","Documentation","Staff training","Support plan"]}]}'
-            return '{"complexity": "medium","total_estimated_hours": 80,"phases": [{"name": "Phase 1: Planning & Design","duration": "1 week","hours": 15,"tasks": ["Requirements analysis","UI mockups","Database schema"]},{"name": "Phase 2: Development","duration": "2 weeks","hours": 40,"tasks": ["Backend development","Frontend development","Integration"]},{"name": "Phase 3: Testing & Launch","duration": "1 week","hours": 25,"tasks": ["Testing","Fixes","Deployment"]}]}'
+        chunks = []
+        async for chunk in self.service.stream(prompt, system=system):
+            chunks.append(chunk)
+            yield chunk
+        if not any(isinstance(chunk, FallbackResponse) for chunk in chunks):
+            self.cache.set(key, "".join(chunks))
+
+    async def invoke_json(self, prompt: str, schema: Type[T], system: Optional[str] = None) -> T:
+        """Invoke the active provider for a response that validates against `schema`"""
+        key = self.cache.key(self._model_id, prompt, system, schema=schema.__name__)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        slot, similar = await self._semantic_get(prompt, system, schema=schema.__name__)
+        if similar is not None:
+            result = schema.model_validate_json(similar)
+            self.cache.set(key, result)
+            return result
         
-        elif "Write a professional" in prompt or "Write professional proposal" in prompt or "Write proposal" in prompt:
-            if "portfolio" in prompt.lower() or "finance" in prompt.lower():
-                return """Dear Debabrata,
+        if hasattr(self.service, "invoke_json"):
+            # Provider enforces the schema server-side; canned fallback replies come back as text
+            response = await self.service.invoke_json(prompt, schema, system=system)
+        else:
+            response = await self.service.invoke(prompt, system=system)
+        if isinstance(response, BaseModel):
+            result = response
+        else:
+            result = schema.model_validate_json(clean_json(response))
+            if isinstance(response, FallbackResponse):
+                # Canned reply after a provider error; valid but never cached
+                return result
+        self.cache.set(key, result)
+        await self._semantic_set(slot, result.model_dump_json())
+        return result
+
+
+# Prompt type markers, matched against the lowercased prompt. The instructions
+# come first, so the leftmost match identifies the task; the group name picks
+# the EnhancedMockService handler.
+_DISPATCH_RE = re.compile(
+    r"(?P<triage>triage this email)"
+    r"|(?P<classify>classify if this email|analyze this email)"
+    r"|(?P<extract>extract structured (?:client )?information)"
+    r"|(?P<plan>create a realistic project plan|create project breakdown)"
+    r"|(?P<proposal>write (?:a professional|professional proposal|proposal))"
+)
+
+# Separator between the emails of a batch triage prompt
+_BATCH_EMAIL_RE = re.compile(r"^--- email \d+ of \d+ ---$", re.MULTILINE)
+
+
+# Canned mock responses, built once at import
+_MOCK_CLASSIFY_FINANCE: Final[str] = '{"is_valid": true, "confidence": 0.95, "reason": "Valid financial services inquiry"}'
+_MOCK_CLASSIFY_GENERIC: Final[str] = '{"is_valid": true, "confidence": 0.9, "reason": "Valid business inquiry"}'
+_MOCK_EXTRACT_FINANCE: Final[str] = '{"client_name": "Debabrata G.","company": "Finance Company","email": "debabrata@financecorp.com","project_type": "AI Agent for Portfolio Management System","requirements": ["Real-time portfolio tracking","Risk analysis and alerts","Automated trading suggestions","Historical performance analytics","Integration with multiple brokers"],"timeline": "3 months","budget": "$15000-$20000"}'
+_MOCK_EXTRACT_GENERIC: Final[str] = '{"client_name": "John Doe","company": "Tech Startup","email": "john@startup.com","project_type": "Web Application","requirements": ["React frontend","Python backend","Database","User auth","API"],"timeline": "2 months","budget": "$10000-$15000"}'
+_MOCK_PLAN_COMPLEX: Final[str] = '{"complexity": "complex","total_estimated_hours": 160,"phases": [{"name": "Phase 1: Discovery & Requirements","duration": "1.5 weeks","hours": 20,"tasks": ["Detailed requirements gathering","Technical design","Architecture review","Security planning"]},{"name": "Phase 2: Core Backend Development","duration": "3 weeks","hours": 60,"tasks": ["Database design","API endpoints","Authentication","Integration services"]},{"name": "Phase 3: Frontend & User Interface","duration": "2 weeks","hours": 40,"tasks": ["UI/UX design","React components","State management","Responsive design"]},{"name": "Phase 4: Testing & Quality Assurance","duration": "1.5 weeks","hours": 25,"tasks": ["Unit tests","Integration tests","Performance testing","Security audit"]},{"name": "Phase 5: Deployment & Handoff","duration": "1 week","hours": 15,"tasks": ["Production setup","Documentation","Staff training","Support plan"]}]}'
+_MOCK_PLAN_MEDIUM: Final[str] = '{"complexity": "medium","total_estimated_hours": 80,"phases": [{"name": "Phase 1: Planning & Design","duration": "1 week","hours": 15,"tasks": ["Requirements analysis","UI mockups","Database schema"]},{"name": "Phase 2: Development","duration": "2 weeks","hours": 40,"tasks": ["Backend development","Frontend development","Integration"]},{"name": "Phase 3: Testing & Launch","duration": "1 week","hours": 25,"tasks": ["Testing","Fixes","Deployment"]}]}'
+
+_MOCK_PROPOSAL_PORTFOLIO: Final[str] = """Dear Debabrata,
 
 Thank you for reaching out. We're excited about your AI Agent for Portfolio Management System project.
 
@@ -91,8 +200,8 @@ Let's schedule a call to discuss your requirements and provide a detailed propos
 
 Best regards,
 OttoMail Solutions"""
-            
-            return """Dear Client,
+
+_MOCK_PROPOSAL_GENERIC: Final[str] = """Dear Client,
 
 Thank you for your inquiry. We're interested in discussing your web application project.
 
@@ -117,5 +226,55 @@ Let's schedule a call to discuss your specific needs.
 
 Best regards,
 OttoMail Solutions"""
+
+
+class EnhancedMockService:
+    """Context-aware mock service for testing and development"""
+    
+    async def invoke(self, prompt: str, system: Optional[str] = None) -> str:
+        """Generate context-aware mock responses based on prompt type"""
+        if system:
+            prompt = f"{system}\n\n{prompt}"
+        print(f"[MOCK LLM]: {prompt[:60]}...")
+        
+        low = prompt.lower()
+        match = _DISPATCH_RE.search(low)
+        if match is None:
+            return '{"response": "Mock service response"}'
+        return getattr(self, f"_{match.lastgroup}")(low)
+    
+    def _triage(self, low: str) -> str:
+        # Batch prompts share the triage instructions; segment 0 is those, each later one a single email
+        segments = _BATCH_EMAIL_RE.split(low)
+        if len(segments) > 1:
+            results = ", ".join(
+                f'{{"email_index": {i}, {self._triage(email)[1:]}'
+                for i, email in enumerate(segments[1:], 1)
+            )
+            return f'{{"results": [{results}]}}'
+        return (
+            f'{{"classification": {self._classify(low)}, '
+            f'"requirements": {self._extract(low)}, '
+            f'"project_plan": {self._plan(low)}}}'
+        )
+    
+    def _classify(self, low: str) -> str:
+        if "finance" in low or "portfolio" in low:
+            return _MOCK_CLASSIFY_FINANCE
+        return _MOCK_CLASSIFY_GENERIC
+    
+    def _extract(self, low: str) -> str:
+        if "portfolio" in low or "finance" in low:
+            return _MOCK_EXTRACT_FINANCE
+        return _MOCK_EXTRACT_GENERIC
+    
+    def _plan(self, low: str) -> str:
+        if "complex" in low or "portfolio" in low:
+            return _MOCK_PLAN_COMPLEX
+        return _MOCK_PLAN_MEDIUM
+    
+    def _proposal(self, low: str) -> str:
+        if "portfolio" in low or "finance" in low:
+            return _MOCK_PROPOSAL_PORTFOLIO
         
-        return '{"response": "Mock service response"}'
+        return _MOCK_PROPOSAL_GENERIC
@@ -1,7 +1,9 @@
 """Local LLM Service using GPT4All with GPU acceleration"""
 import os
 import sys
-from pydantic_settings import BaseSettings
+from typing import Optional
+from integrations._settings import settings
+from integrations.llm_cache import FallbackResponse
 
 try:
     from gpt4all import GPT4All
@@ -10,16 +12,6 @@ except ImportError:
     GPT4ALL_AVAILABLE = False
     GPT4All = None
 
-class LLMConfig(BaseSettings):
-    LLM_MODEL_PATH: str = "Meta-Llama-3-8B-Instruct.Q4_0.gguf"
-    LLM_DEVICE: str = "gpu"  # Explicitly use GPU
-
-    class Config:
-        env_file = ".env"
-        extra = "ignore"
-
-config = LLMConfig()
-
 class LocalLLMService:
     _model_instance = None
 
@@ -31,6 +23,7 @@ class LocalLLMService:
             return
         
         if not LocalLLMService._model_instance:
+            config = settings()
             print(f"Loading Local LLM: {config.LLM_MODEL_PATH} on {config.LLM_DEVICE}...")
             try:
                 # device='gpu' will auto-detect CUDA/Vulkan
@@ -55,10 +48,12 @@ class LocalLLMService:
                     print(f"Could not load LLM (download likely in progress). Using Mock Fallback. Error: {e}")
                     LocalLLMService._model_instance = None
 
-    async def invoke(self, prompt: str) -> str:
+    async def invoke(self, prompt: str, system: Optional[str] = None) -> str:
         """Invoke Local LLM and return response"""
+        if system:
+            prompt = f"{system}\n\n{prompt}"
         if not LocalLLMService._model_instance:
-            return self._mock_fallback(prompt)
+            return FallbackResponse(self._mock_fallback(prompt))
             
         import asyncio
         return await asyncio.to_thread(self._generate, prompt)
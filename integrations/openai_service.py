@@ -1,30 +1,40 @@
 """Multi-LLM service with fallback"""
+import importlib.util
 import os
-from typing import Literal
+import httpx
+from typing import AsyncIterator, Dict, Optional, Type
+from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
-from pydantic_settings import BaseSettings
-
-class LLMConfig(BaseSettings):
-    LLM_PROVIDER: Literal["openai", "gemini"] = "openai"
-    OPENAI_API_KEY: str = ""
-    GOOGLE_API_KEY: str = ""
-    LLM_MODEL: str = "gpt-4o-mini"
-
-config = LLMConfig()
+from pydantic import BaseModel
+from integrations._settings import settings
 
 class LLMService:
     def __init__(self):
+        self._http: Optional[httpx.AsyncClient] = None
         self.llm = self._create_llm()
+        # with_structured_output converts the schema to a tool spec; build it once per model
+        self._structured: Dict[Type[BaseModel], object] = {}
     
     def _create_llm(self):
         """Create LLM with automatic fallback"""
+        config = settings()
         try:
-            if config.LLM_PROVIDER == "openai" and config.OPENAI_API_KEY:
+            # OpenAI unless Gemini is explicitly selected
+            if config.LLM_PROVIDER != "gemini" and config.OPENAI_API_KEY:
+                # Concurrent calls reuse warm keep-alive connections (multiplexed over
+                # HTTP/2 when h2 is installed) instead of new TLS handshakes
+                self._http = httpx.AsyncClient(
+                    http2=importlib.util.find_spec("h2") is not None,
+                    limits=httpx.Limits(max_keepalive_connections=64, max_connections=128),
+                    timeout=60
+                )
                 return ChatOpenAI(
                     model=config.LLM_MODEL,
                     api_key=config.OPENAI_API_KEY,
-                    temperature=0.3
+                    temperature=0.3,
+                    http_async_client=self._http,
+                    max_retries=2
                 )
         except:
             pass
@@ -42,7 +52,36 @@ class LLMService:
         
         raise Exception("No working LLM configured. Set OPENAI_API_KEY or GOOGLE_API_KEY")
     
-    async def invoke(self, prompt: str) -> str:
+    def _messages(self, prompt: str, system: Optional[str] = None):
+        if system:
+            # Static instructions first and the email last: OpenAI caches repeated prompt prefixes
+            # automatically, so nothing per-email may come before the system message ends
+            return [SystemMessage(content=system), HumanMessage(content=prompt)]
+        return prompt
+    
+    async def aclose(self):
+        """Close the OpenAI connection pool"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+    
+    async def invoke(self, prompt: str, system: Optional[str] = None) -> str:
         """Invoke LLM and return response"""
-        response = await self.llm.ainvoke(prompt)
+        response = await self.llm.ainvoke(self._messages(prompt, system))
         return response.content
+    
+    async def stream(self, prompt: str, system: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream response text as it is generated"""
+        async for chunk in self.llm.astream(self._messages(prompt, system)):
+            if chunk.content:
+                yield chunk.content
+    
+    async def invoke_json(self, prompt: str, schema: Type[BaseModel], system: Optional[str] = None) -> BaseModel:
+        """Invoke with structured output so the provider enforces the schema"""
+        structured = self._structured.get(schema)
+        if structured is None:
+            structured = self._structured[schema] = self.llm.with_structured_output(schema)
+        result = await structured.ainvoke(self._messages(prompt, system))
+        if result is None:
+            raise ValueError("LLM returned no structured output")
+        return result
@@ -0,0 +1,81 @@
+"""Persistent similarity cache for LLM responses"""
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+    SEMANTIC_CACHE_AVAILABLE = True
+except ImportError:
+    SEMANTIC_CACHE_AVAILABLE = False
+    np = None
+    SentenceTransformer = None
+
+
+class SemanticCache:
+    """Near-duplicate prompt cache: a prompt whose embedding is close enough to an
+    earlier one in the same namespace reuses that response.
+
+    Entries are stored in SQLite so they survive restarts; the normalized
+    embeddings of each namespace are also held as one in-memory matrix, so a
+    lookup is a single matrix-vector product.
+    """
+
+    def __init__(
+        self,
+        path: str = "semantic_cache.db",
+        model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+        threshold: float = 0.92,
+        enabled: bool = True,
+    ):
+        self.threshold = threshold
+        self.enabled = enabled and SEMANTIC_CACHE_AVAILABLE
+        if enabled and not SEMANTIC_CACHE_AVAILABLE:
+            print("⚠️  sentence-transformers not installed. Install with: pip install sentence-transformers")
+            print("Semantic cache disabled.")
+        if not self.enabled:
+            return
+
+        self._model = SentenceTransformer(model_name)
+        self._lock = threading.Lock()
+        # namespace -> (embedding matrix, responses in matrix row order)
+        self._index: Dict[bytes, Tuple["np.ndarray", List[str]]] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY, namespace BLOB NOT NULL, embedding BLOB NOT NULL, response TEXT NOT NULL)"
+        )
+        rows = self._conn.execute("SELECT namespace, embedding, response FROM entries ORDER BY id").fetchall()
+        grouped: Dict[bytes, Tuple[list, List[str]]] = {}
+        for namespace, embedding, response in rows:
+            vectors, responses = grouped.setdefault(namespace, ([], []))
+            vectors.append(np.frombuffer(embedding, dtype=np.float32))
+            responses.append(response)
+        for namespace, (vectors, responses) in grouped.items():
+            self._index[namespace] = (np.vstack(vectors), responses)
+
+    def embed(self, text: str) -> "np.ndarray":
+        """Unit-length embedding, so a dot product is the cosine similarity"""
+        return self._model.encode(" ".join(text.split()), normalize_embeddings=True).astype(np.float32)
+
+    def get(self, namespace: bytes, vector: "np.ndarray") -> Optional[str]:
+        with self._lock:
+            entry = self._index.get(namespace)
+        if entry is None:
+            return None
+        matrix, responses = entry
+        scores = matrix @ vector
+        best = int(scores.argmax())
+        return responses[best] if scores[best] >= self.threshold else None
+
+    def set(self, namespace: bytes, vector: "np.ndarray", response: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO entries (namespace, embedding, response) VALUES (?, ?, ?)",
+                (namespace, vector.tobytes(), response)
+            )
+            self._conn.commit()
+            matrix, responses = self._index.get(namespace, (np.empty((0, vector.shape[0]), dtype=np.float32), []))
+            # A new matrix rather than an in-place append, so concurrent readers keep a consistent pair
+            self._index[namespace] = (np.vstack([matrix, vector]), responses + [response])
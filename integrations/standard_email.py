@@ -4,25 +4,16 @@ import smtplib
 import email
 from email.mime.text import MIMEText
 from email.header import decode_header
-from pydantic_settings import BaseSettings
-
-class EmailConfig(BaseSettings):
-    EMAIL_USER: str
-    EMAIL_PASSWORD: str
-    IMAP_SERVER: str = "imap.gmail.com"
-    SMTP_SERVER: str = "smtp.gmail.com"
-    SMTP_PORT: int = 465
-
-    class Config:
-        env_file = ".env"
-        extra = "ignore"
-
-config = EmailConfig()
+from integrations._settings import settings
 
 class StandardEmailService:
     def __init__(self):
+        config = settings()
+        if not config.EMAIL_USER or not config.EMAIL_PASSWORD:
+            raise ValueError("EMAIL_USER and EMAIL_PASSWORD are required for Standard Email Service")
         self.imap_server = config.IMAP_SERVER
         self.smtp_server = config.SMTP_SERVER
+        self.smtp_port = config.SMTP_PORT
         self.user = config.EMAIL_USER
         self.password = config.EMAIL_PASSWORD
 
@@ -82,6 +73,8 @@ class StandardEmailService:
 
                         results.append({
                             "id": e_id.decode(),
+                            # Sequence numbers are reused once mail is archived; Message-ID is not
+                            "message_id": msg.get("Message-ID"),
                             "from": from_,
                             "subject": subject,
                             "body": body,
@@ -106,7 +99,7 @@ class StandardEmailService:
         msg["From"] = self.user
         msg["To"] = to
 
-        with smtplib.SMTP_SSL(self.smtp_server, config.SMTP_PORT) as server:
+        with smtplib.SMTP_SSL(self.smtp_server, self.smtp_port) as server:
             server.login(self.user, self.password)
             server.send_message(msg)
 
@@ -115,6 +108,13 @@ class StandardEmailService:
         import asyncio
         await asyncio.to_thread(self._mark_read_blocking, msg_id)
 
+    async def mark_many_as_read(self, msg_ids):
+        """Mark several emails as seen with a single STORE"""
+        if not msg_ids:
+            return
+        import asyncio
+        await asyncio.to_thread(self._mark_read_blocking, ",".join(msg_ids))
+
     def _mark_read_blocking(self, msg_id):
         mail = self._connect_imap()
         try:
@@ -1,73 +1,151 @@
 """Database storage service"""
+from sqlalchemy import func, select, union
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.sqlite import insert
 from datetime import datetime
-from app.models import SessionLocal, Client, Proposal
+from app.models import SessionLocal, Client, Inquiry, Proposal
 from app.schemas import EmailSchema, ProposalSchema
 import json
 
+# Per-email project details; rows written before the inquiries table fall back to the client's
+_PROJECT_TYPE = func.coalesce(Inquiry.project_type, Client.project_type).label('project_type')
+
 class StorageService:
     def __init__(self):
         self.db = SessionLocal()
     
-    def create_client(self, state):
-        # Check if client already exists by email_id (Gmail message ID)
-        existing_client = self.db.query(Client).filter(Client.email_id == state.get('email_id')).first()
-        if existing_client:
-            return existing_client.id
-            
-        client = Client(
-            name=state['client_name'],
-            email=state['email_from'],
-            company=state.get('company'),
-            project_type=state['project_type'],
-            requirements=json.dumps(state.get('requirements', [])),
-            timeline=state.get('timeline'),
-            budget=state.get('budget'),
-            thread_id=state['thread_id'],
-            email_id=state.get('email_id')  # Store Gmail message ID
+    def save_proposals(self, records):
+        """Store (state, draft_id) pairs as clients + proposals in a single transaction.
+        
+        A repeat sender keeps one client row (ON CONFLICT(email) only refreshes the
+        contact details); the project details and message ID of every email go in
+        its own inquiries row, so earlier proposals keep their own project.
+        Returns proposal ids aligned with `records`; a record that fails to store
+        is rolled back to its own SAVEPOINT and gets None.
+        """
+        proposal_ids = []
+        try:
+            # pysqlite only opens a transaction before DML, so the first SAVEPOINT would start
+            # one of its own and its RELEASE would commit it; open the outer one explicitly
+            self.db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+            for state, draft_id in records:
+                try:
+                    with self.db.begin_nested():
+                        proposal_ids.append(self._save_proposal(state, draft_id))
+                except Exception as e:
+                    print(f"[ERROR] Failed to store proposal for email {state.get('email_id', 'unknown')}: {e}")
+                    proposal_ids.append(None)
+            self.db.commit()
+        except BaseException:
+            # Leave the session usable (and nothing half-written) for the next call
+            self.db.rollback()
+            raise
+        return proposal_ids
+    
+    def _save_proposal(self, state, draft_id):
+        """Client upsert + proposal + inquiry rows for one record; returns the proposal id"""
+        inquiry_values = {
+            'project_type': state['project_type'],
+            'requirements': json.dumps(state.get('requirements', [])),
+            'timeline': state.get('timeline'),
+            'budget': state.get('budget'),
+            'thread_id': state['thread_id']
+        }
+        contact_values = {'name': state['client_name'], 'company': state.get('company')}
+        client_stmt = insert(Client).values(email=state['email_from'], **contact_values, **inquiry_values)
+        client_id = self.db.execute(
+            client_stmt.on_conflict_do_update(index_elements=[Client.email], set_=contact_values)
+            .returning(Client.id)
+        ).scalar_one()
+        
+        proposal_id = self.db.execute(
+            insert(Proposal).values(
+                client_id=client_id,
+                proposal_text=state['proposal_text'],
+                cost_min=state['cost_estimate']['min'],
+                cost_max=state['cost_estimate']['max'],
+                draft_id=draft_id,
+                status='pending'
+            ).returning(Proposal.id)
+        ).scalar_one()
+        self.db.execute(
+            insert(Inquiry).values(
+                client_id=client_id,
+                proposal_id=proposal_id,
+                email_id=state.get('email_id'),
+                **inquiry_values
+            )
         )
-        self.db.add(client)
-        self.db.commit()
-        self.db.refresh(client)
-        return client.id
+        return proposal_id
     
-    def create_proposal(self, client_id, state, draft_id):
-        proposal = Proposal(
-            client_id=client_id,
-            proposal_text=state['proposal_text'],
-            cost_min=state['cost_estimate']['min'],
-            cost_max=state['cost_estimate']['max'],
-            draft_id=draft_id,
-            status='pending'
+    def get_pending_proposals(self, limit=50):
+        """Newest pending proposals with their client, in one joined query"""
+        rows = (
+            self.db.query(
+                Proposal.id, Client.name, Client.email, _PROJECT_TYPE,
+                Proposal.proposal_text, Proposal.cost_min, Proposal.cost_max,
+                Proposal.status, Proposal.created_at
+            )
+            .join(Client, Client.id == Proposal.client_id)
+            .outerjoin(Inquiry, Inquiry.proposal_id == Proposal.id)
+            .filter(Proposal.status == 'pending')
+            .order_by(Proposal.created_at.desc())
+            .limit(limit)
+            .all()
         )
-        self.db.add(proposal)
-        self.db.commit()
-        self.db.refresh(proposal)
-        return proposal.id
+        return [{
+            'id': row.id,
+            'client_name': row.name,
+            'client_email': row.email,
+            'project_type': row.project_type,
+            'proposal_text': row.proposal_text,
+            'cost_min': row.cost_min,
+            'cost_max': row.cost_max,
+            'status': row.status,
+            'created_at': row.created_at
+        } for row in rows]
     
-    def get_pending_proposals(self):
-        proposals = self.db.query(Proposal).filter(Proposal.status == 'pending').all()
-        result = []
-        for p in proposals:
-            client = self.db.query(Client).filter(Client.id == p.client_id).first()
-            result.append({
-                'id': p.id,
-                'client_name': client.name,
-                'client_email': client.email,
-                'project_type': client.project_type,
-                'proposal_text': p.proposal_text,
-                'cost_min': p.cost_min,
-                'cost_max': p.cost_max,
-                'status': p.status
-            })
-        return result
+    def get_proposal_detail(self, proposal_id):
+        """Full proposal row plus the client's extracted requirements"""
+        row = (
+            self.db.query(Proposal, Client, Inquiry)
+            .join(Client, Client.id == Proposal.client_id)
+            .outerjoin(Inquiry, Inquiry.proposal_id == Proposal.id)
+            .filter(Proposal.id == proposal_id)
+            .first()
+        )
+        if not row:
+            return None
+        proposal, client, inquiry = row
+        # Older proposals predate the inquiries table and only have the client's details
+        project = inquiry or client
+        return {
+            'id': proposal.id,
+            'client_id': client.id,
+            'client_name': client.name,
+            'client_email': client.email,
+            'company': client.company,
+            'project_type': project.project_type,
+            'requirements': json.loads(project.requirements or '[]'),
+            'timeline': project.timeline,
+            'budget': project.budget,
+            'proposal_text': proposal.proposal_text,
+            'cost_min': proposal.cost_min,
+            'cost_max': proposal.cost_max,
+            'status': proposal.status,
+            'draft_id': proposal.draft_id,
+            'approved': proposal.approved,
+            'sent_at': proposal.sent_at,
+            'created_at': proposal.created_at
+        }
     
     def get_proposal(self, proposal_id):
-        return self.db.query(Proposal).filter(Proposal.id == proposal_id).first()
+        # Primary-key lookups hit the session identity map before issuing SQL
+        return self.db.get(Proposal, proposal_id)
 
     def get_client(self, client_id):
-        return self.db.query(Client).filter(Client.id == client_id).first()
+        return self.db.get(Client, client_id)
     
     def approve_proposal(self, proposal_id):
         proposal = self.get_proposal(proposal_id)
@@ -91,8 +169,18 @@ class StorageService:
     
     def is_email_processed(self, email_id):
         """Check if email has already been processed by looking up email_id in database"""
-        existing = self.db.query(Client).filter(Client.email_id == email_id).first()
-        return existing is not None
+        return email_id in self.processed_email_ids([email_id])
+    
+    def processed_email_ids(self, email_ids):
+        """Subset of `email_ids` already processed, in one query"""
+        if not email_ids:
+            return set()
+        # clients.email_id still covers emails processed before the inquiries table existed
+        rows = self.db.execute(union(
+            select(Inquiry.email_id).where(Inquiry.email_id.in_(email_ids)),
+            select(Client.email_id).where(Client.email_id.in_(email_ids))
+        ))
+        return {email_id for email_id, in rows}
     
     def close(self):
         self.db.close()
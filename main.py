@@ -3,15 +3,25 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from app.api.routes import router as api_router
 from app.models import init_db
+from agent.graph import close_checkpointer
+from integrations.llm_wrapper import UnifiedLLM
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Close pooled connections on the loop that opened them
+    await close_checkpointer()
+    await UnifiedLLM.aclose()
 
 # Initialize
 init_db()
-app = FastAPI(title="Email AI Copilot MVP")
+app = FastAPI(title="Email AI Copilot MVP", lifespan=lifespan)
 
 app.include_router(api_router, prefix="/api")
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -1,12 +1,27 @@
 import sqlite3
 
-def reset_email(email_id):
+def reset_email(email_id, client_email_pattern="%krish.learndev%"):
+    """Forget an email (and the matching demo clients) so the agent processes it again"""
     conn = sqlite3.connect("copilot.db")
     c = conn.cursor()
-    c.execute("DELETE FROM processed_emails WHERE email_id = ?", (email_id,))
-    c.execute("DELETE FROM proposals WHERE id IN (SELECT id FROM proposals WHERE client_id IN (SELECT id FROM clients WHERE email LIKE '%krish.learndev%'))") 
-    # That might be too complex, just clearing processed_emails is enough to trigger the agent logic again.
-    # The agent might create duplicate client/proposal entries but that's fine for a demo.
+    # Journal mode can't change inside a transaction, so set it before BEGIN
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    # Same index as app.models.Proposal.client_id, for databases created before it existed
+    c.execute("CREATE INDEX IF NOT EXISTS ix_proposals_client_id ON proposals (client_id)")
+    c.execute("BEGIN IMMEDIATE")
+    # Processed emails are tracked by inquiries.email_id (clients.email_id on older rows)
+    c.execute("DELETE FROM proposals WHERE id IN (SELECT proposal_id FROM inquiries WHERE email_id = ?)", (email_id,))
+    c.execute("DELETE FROM inquiries WHERE email_id = ?", (email_id,))
+    c.execute("""
+        WITH target_clients AS (SELECT id FROM clients WHERE email_id = ? OR email LIKE ?)
+        DELETE FROM inquiries WHERE client_id IN target_clients
+    """, (email_id, client_email_pattern))
+    c.execute("""
+        WITH target_clients AS (SELECT id FROM clients WHERE email_id = ? OR email LIKE ?)
+        DELETE FROM proposals WHERE client_id IN target_clients
+    """, (email_id, client_email_pattern))
+    c.execute("DELETE FROM clients WHERE email_id = ? OR email LIKE ?", (email_id, client_email_pattern))
     conn.commit()
     print(f"Reset email {email_id}")
     conn.close()
@@ -3,7 +3,12 @@ import sqlite3
 def reset_all():
     conn = sqlite3.connect("copilot.db")
     c = conn.cursor()
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    # All tables cleared in one write transaction
+    c.execute("BEGIN IMMEDIATE")
     c.execute("DELETE FROM clients")
+    c.execute("DELETE FROM inquiries")
     c.execute("DELETE FROM proposals")
     conn.commit()
     print("Database cleared.")
@@ -1,6 +1,8 @@
-from integrations.standard_email import config
+from integrations._settings import settings
 import imaplib
 
+config = settings()
+
 print(f"Checking Email Connection for {config.EMAIL_USER}...")
 if "your_email" in config.EMAIL_USER:
     print("SKIPPING: Please update .env with real EMAIL_USER and EMAIL_PASSWORD")
@@ -1,9 +1,12 @@
 """Test agent with REAL emails from Gmail inbox"""
 import asyncio
+from operator import itemgetter
 import json
-import imaplib
-import email
-from email.header import decode_header
+import re
+import sys
+import aioimaplib
+from email import policy
+from email.parser import BytesHeaderParser, BytesParser
 from agent.graph import EmailAgentGraph
 from integrations.llm_wrapper import UnifiedLLM
 import os
@@ -13,46 +16,226 @@ load_dotenv()
 
 EMAIL_USER = os.getenv("EMAIL_USER")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
-LLM_PROVIDER = os.getenv("LLM_PROVIDER", "mock")
+# Read once at import; nothing below calls os.getenv again
+LLM_PROVIDER_LABEL = os.getenv("LLM_PROVIDER", "mock").upper()
+_PLACEHOLDER_PASSWORD = "xxxx xxxx xxxx xxxx"
 
+# Enough of the body for the 1000-character preview, even base64-encoded inside a multipart
+BODY_PREVIEW_BYTES = 4096
+# Only the headers the script reads plus the ones needed to walk the MIME parts of the body,
+# and only the first BODY_PREVIEW_BYTES of the body itself
+FETCH_ITEMS = (
+    "(BODY.PEEK[HEADER.FIELDS (FROM SUBJECT CONTENT-TYPE CONTENT-TRANSFER-ENCODING)] "
+    f"BODY.PEEK[TEXT]<0.{BODY_PREVIEW_BYTES}>)"
+)
 
-def get_gmail_emails(max_emails=3):
-    """Fetch emails from Gmail inbox"""
-    print("=" * 80)
-    print(f"CONNECTING TO GMAIL: {EMAIL_USER}")
-    print("=" * 80)
-    
+# One JSON line per processed email, appended across runs
+RUNS_FILE = "runs.jsonl"
+# High-water UID of the last fetch, kept next to RUNS_FILE
+LAST_UID_FILE = "last_uid.json"
+# Gmail ends an IDLE after ~29 minutes; reconnect a little before that
+IDLE_TIMEOUT = 25 * 60
+# Emails run through the graph concurrently
+WORKERS = 2
+
+# Report fields, read from the result in one pass
+_REPORT_FIELDS = itemgetter(
+    "is_valid_inquiry", "confidence_score", "current_step", "client_name", "company", "project_type",
+    "timeline", "budget", "requirements", "project_plan", "cost_estimate", "proposal_text"
+)
+SEP = "=" * 80
+
+_UID_RE = re.compile(rb"UID (\d+)")
+_UIDVALIDITY_RE = re.compile(rb"\[UIDVALIDITY (\d+)\]")
+_HEADER_PARSER = BytesHeaderParser(policy=policy.default)
+_BODY_PARSER = BytesParser(policy=policy.default)
+
+
+def _load_last_uid(uidvalidity):
+    """Highest UID already fetched, or 0 if unknown or the mailbox was renumbered"""
     try:
-        mail = imaplib.IMAP4_SSL("imap.gmail.com")
-        mail.login(EMAIL_USER, EMAIL_PASSWORD)
-        print(f"[OK] Connected to Gmail\n")
-        
-        mail.select("INBOX")
-        status, messages = mail.search(None, "ALL")
-        email_ids = messages[0].split()[-max_emails:]  # Get last N emails
+        with open(LAST_UID_FILE, encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    return saved.get("last_uid", 0) if saved.get("uidvalidity") == uidvalidity else 0
+
+
+def _save_last_uid(uidvalidity, last_uid):
+    with open(LAST_UID_FILE, "w", encoding="utf-8") as f:
+        json.dump({"uidvalidity": uidvalidity, "last_uid": last_uid}, f)
+
+
+def _split_fetch_response(lines):
+    """Reassemble a multi-message FETCH response into {UID: (header bytes, body text bytes)}"""
+    headers, texts, uids = {}, {}, {}
+    seq = descriptor = None
+    for line in lines:
+        # aioimaplib hands each literal over as a bytearray right after the text that announced it
+        if isinstance(line, bytearray):
+            payload = bytes(line)
+            if b"HEADER" in descriptor.upper():
+                headers[seq] = payload
+            else:
+                cut = payload.rfind(b"\n")
+                if len(payload) >= BODY_PREVIEW_BYTES and cut >= 0:
+                    # Cut at the last full line; a partial base64 line makes the whole part undecodable
+                    payload = payload[:cut + 1]
+                texts[seq] = payload
+            continue
+        descriptor = line
+        if descriptor[:1].isdigit():
+            seq = descriptor.split(None, 1)[0]
+        match = _UID_RE.search(descriptor)
+        if match:
+            uids[seq] = match.group(1)
+    return {uids.get(seq, seq): (headers[seq], texts.get(seq, b"")) for seq in headers}
+
+
+def _text_content(part):
+    """Text of a MIME part, transfer-decoded and charset-decoded in one get_content() pass"""
+    try:
+        return part.get_content()
+    except LookupError:
+        # Charset Python doesn't know; fall back to lenient UTF-8
+        return part.get_payload(decode=True).decode("utf-8", errors="ignore")
+
+
+def _check(response, command):
+    """Raise on a non-OK tagged response so callers can treat it like a failed call"""
+    if response.result != "OK":
+        raise RuntimeError(f"{command} failed: {response.lines[-1]!r}")
+    return response
+
+
+def _print_connect_help(error):
+    print(f"[ERROR] Error connecting to Gmail: {error}")
+    print(f"\nMake sure:")
+    print(f"  1. EMAIL_USER = {EMAIL_USER}")
+    print(f"  2. EMAIL_PASSWORD is correct (16-char app password)")
+    print(f"  3. Gmail IMAP is enabled (Settings > Forwarding and POP/IMAP)")
+    print(f"\nTo get app password:")
+    print(f"  https://myaccount.google.com → Security → App passwords")
+
+
+class GmailSource:
+    """Gmail inbox over one IMAP connection held open for the whole session.
+    
+    The TLS handshake, LOGIN and SELECT are paid once in __aenter__; aioimaplib
+    runs the IMAP I/O on the event loop, overlapping it with the graph runs.
+    """
+    
+    def __init__(self):
+        self.client = None
+        self.uidvalidity = None
+        self._fetched_uid = None  # Highest UID handed out this session; loaded on connect
+        self._saved_uid = 0
+        self._in_flight = set()  # Fetched UIDs whose graph run hasn't finished
+    
+    async def __aenter__(self):
+        print(f"{SEP}\nCONNECTING TO GMAIL: {EMAIL_USER}\n{SEP}")
+        try:
+            await self._connect()
+            print(f"[OK] Connected to Gmail\n")
+        except Exception as e:
+            _print_connect_help(e)
+            self.client = None
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        if self.client is not None:
+            await self._logout()
+    
+    async def _connect(self):
+        self.client = aioimaplib.IMAP4_SSL(host="imap.gmail.com")
+        await self.client.wait_hello_from_server()
+        _check(await self.client.login(EMAIL_USER, EMAIL_PASSWORD), "LOGIN")
+        response = _check(await self.client.select("INBOX"), "SELECT")
+        match = _UIDVALIDITY_RE.search(b" ".join(line for line in response.lines if isinstance(line, bytes)))
+        uidvalidity = int(match.group(1)) if match else None
+        if self._fetched_uid is None or uidvalidity != self.uidvalidity:
+            # First connect, or the mailbox was renumbered: UIDs from before mean nothing now
+            self.uidvalidity = uidvalidity
+            self._fetched_uid = self._saved_uid = _load_last_uid(uidvalidity)
+            self._in_flight.clear()
+    
+    async def _logout(self):
+        try:
+            await self.client.close()
+            await self.client.logout()
+        except (aioimaplib.Abort, asyncio.TimeoutError, OSError):
+            pass
+        self.client = None
+    
+    async def stream(self, max_emails=3, watch=False):
+        """Yield each batch of new emails; with watch, IDLE for more instead of stopping"""
+        while self.client is not None:
+            emails = await self._fetch_new(max_emails)
+            if emails:
+                yield emails
+            if not watch:
+                return
+            if len(emails) == max_emails:
+                continue  # Possibly more new mail past the batch; fetch it before going idle
+            try:
+                await self._idle()
+            except (aioimaplib.Abort, asyncio.TimeoutError, OSError) as e:
+                # Gmail drops long-lived connections now and then; log in again and carry on
+                print(f"[DEBUG] IMAP connection lost, reconnecting: {e}")
+                await self._connect()
+    
+    async def _fetch_new(self, max_emails):
+        """Fetch emails that arrived in the inbox since the last fetch"""
+        try:
+            last_uid = self._fetched_uid
+            # Only UIDs above the high-water mark cross the wire, not the whole mailbox
+            response = _check(await self.client.uid_search(f"UID {last_uid + 1}:*", charset=None), "UID SEARCH")
+            # "n:*" always matches the newest message, even when it is below n
+            email_ids = [uid for uid in response.lines[0].split() if uid.isdigit() and int(uid) > last_uid]
+            if last_uid:
+                # Oldest first, so mail past the cut is fetched next time instead of skipped
+                email_ids = email_ids[:max_emails]
+            else:
+                # No saved mark yet: start from the latest N emails, not the whole mailbox
+                email_ids = email_ids[-max_emails:]
+            if not email_ids:
+                return []
+            
+            # One FETCH for the whole set instead of a round-trip per email; PEEK leaves \Seen alone
+            response = _check(await self.client.uid("fetch", b",".join(email_ids).decode(), FETCH_ITEMS), "UID FETCH")
+            raw_messages = _split_fetch_response(response.lines)
+            self._fetched_uid = int(email_ids[-1])
+        except RuntimeError as e:
+            print(f"[ERROR] Error fetching from Gmail: {e}")
+            return []
         
         emails = []
         for email_id in email_ids:
-            status, msg_data = mail.fetch(email_id, "(RFC822)")
-            msg = email.message_from_bytes(msg_data[0][1])
+            if email_id not in raw_messages:
+                continue
+            header_bytes, text_bytes = raw_messages[email_id]
+            # Headers only; the MIME tree is built just for multipart bodies below
+            msg = _HEADER_PARSER.parsebytes(header_bytes)
             
-            # Decode subject
-            subject, encoding = decode_header(msg["Subject"])[0]
-            if isinstance(subject, bytes):
-                subject = subject.decode(encoding or "utf-8")
+            # policy.default decodes RFC 2047 encoded words itself
+            subject = str(msg["Subject"] or "")
             
             # Get sender
             sender = msg.get("From", "Unknown")
             
             # Get body
             body = ""
-            if msg.is_multipart():
-                for part in msg.walk():
+            if msg.get_content_maintype() == "multipart":
+                # The header literal already ends with the blank separator line
+                for part in _BODY_PARSER.parsebytes(header_bytes + text_bytes).walk():
                     if part.get_content_type() == "text/plain":
-                        body = part.get_payload(decode=True).decode("utf-8", errors="ignore")
+                        body = _text_content(part)
                         break
             else:
-                body = msg.get_payload(decode=True).decode("utf-8", errors="ignore")
+                # Single part: decode the fetched text directly with the header's transfer encoding
+                msg.set_payload(text_bytes.decode("ascii", "surrogateescape"))
+                if msg.get_content_maintype() == "text":
+                    body = _text_content(msg)
             
             emails.append({
                 "id": email_id.decode(),
@@ -60,157 +243,200 @@ def get_gmail_emails(max_emails=3):
                 "subject": subject,
                 "body": body[:1000]  # Take first 1000 chars
             })
+            self._in_flight.add(int(email_id))
         
-        mail.close()
-        mail.logout()
         return emails
-        
-    except Exception as e:
-        print(f"[ERROR] Error connecting to Gmail: {e}")
-        print(f"\nMake sure:")
-        print(f"  1. EMAIL_USER = {EMAIL_USER}")
-        print(f"  2. EMAIL_PASSWORD is correct (16-char app password)")
-        print(f"  3. Gmail IMAP is enabled (Settings > Forwarding and POP/IMAP)")
-        print(f"\nTo get app password:")
-        print(f"  https://myaccount.google.com → Security → App passwords")
-        return []
+    
+    def mark_done(self, email_id):
+        """Record a processed email; the saved mark only moves past UIDs that all finished"""
+        self._in_flight.discard(int(email_id))
+        # A failed or still-running email holds the mark below it, so the next run retries it
+        last_uid = min(self._in_flight) - 1 if self._in_flight else self._fetched_uid
+        if last_uid > self._saved_uid:
+            _save_last_uid(self.uidvalidity, last_uid)
+            self._saved_uid = last_uid
+    
+    async def _idle(self, timeout=IDLE_TIMEOUT):
+        """Wait in IMAP IDLE until the server reports new mail; False if the timeout passed first"""
+        idle = await self.client.idle_start(timeout=timeout)
+        arrived = False
+        while not arrived:
+            push = await self.client.wait_server_push()
+            # aioimaplib ends the IDLE itself at the timeout and queues this marker
+            if push == aioimaplib.STOP_WAIT_SERVER_PUSH:
+                break
+            arrived = any(line.endswith(b"EXISTS") for line in push if isinstance(line, bytes))
+        if self.client.has_pending_idle():
+            self.client.idle_done()
+        await asyncio.wait_for(idle, 30)
+        return arrived
+
+
+# Keys every email starts with; the per-email fields are filled in by build_state
+_STATE_TEMPLATE = {
+    "client_name": None,
+    "company": None,
+    "project_type": None,
+    "requirements": None,
+    "timeline": None,
+    "budget": None,
+    "project_plan": None,
+    "cost_estimate": None,
+    "proposal_text": None,
+    "is_valid_inquiry": False,
+    "confidence_score": 0.0,
+    "needs_human_review": False,
+    "current_step": "starting",
+    "error": None
+}
+
 
+def build_state(gmail_email):
+    """Initial graph state for a fetched email"""
+    state = _STATE_TEMPLATE.copy()
+    state.update(
+        messages=[],  # Mutable, so created per email instead of shared through the template
+        email_id=gmail_email["id"],
+        email_from=gmail_email["from"],
+        email_subject=gmail_email["subject"],
+        email_body=gmail_email["body"],
+        thread_id=gmail_email["id"]
+    )
+    return state
 
-async def test_real_emails():
-    """Test agent with real Gmail emails"""
+
+async def process_email(graph, idx, gmail_email, initial_state, runs):
+    """Run one email through the graph and print its report"""
+    print(f"Processing email #{idx} with AI...\n")
+    result = await graph.graph.ainvoke(initial_state)
     
-    print(f"\nLLM Provider: {LLM_PROVIDER.upper()}")
-    print("=" * 80)
+    # Save result for verification; compact and buffered, flushed when the run ends
+    runs.write(json.dumps(result, default=str, ensure_ascii=False) + "\n")
+    (is_valid, conf, status, client_name, company, project_type,
+     timeline, budget, reqs, plan, cost, proposal) = _REPORT_FIELDS(result)
     
-    # Get real emails
-    emails = get_gmail_emails(max_emails=2)
+    # Printed after the run so each email's report stays together
+    print(f"\n{SEP}\nEMAIL #{idx}\n{SEP}")
+    print(f"From: {gmail_email['from']}")
+    print(f"Subject: {gmail_email['subject']}")
+    print(f"Body preview: {gmail_email['body'][:150]}...\n")
     
-    if not emails:
-        print("\n[ERROR] No emails found. Exiting.")
+    # Display results
+    print(f"{SEP}\nCLASSIFICATION\n{SEP}")
+    print(f"Valid: {is_valid}")
+    if isinstance(conf, (int, float)):
+        print(f"Confidence: {conf:.0%}" if conf <= 1 else f"Confidence: {conf}%")
+    print(f"Status: {status}\n")
+    
+    if not is_valid:
+        print("(Skipping - not a valid inquiry)\n")
         return
     
-    print(f"[OK] Found {len(emails)} email(s) to process\n")
+    print(f"{SEP}\nEXTRACTED DATA\n{SEP}")
+    print(f"Client: {client_name}")
+    print(f"Company: {company}")
+    print(f"Project: {project_type}")
+    print(f"Timeline: {timeline}")
+    print(f"Budget: {budget}\n")
+    
+    if reqs and isinstance(reqs, list):
+        print("Requirements:")
+        for req in reqs:
+            print(f"  • {req}")
+    
+    print(f"\n{SEP}\nPROJECT PLAN\n{SEP}")
+    if plan:
+        print(f"Complexity: {plan.get('complexity', 'N/A')}")
+        print(f"Hours: {plan.get('total_estimated_hours', 'N/A')}")
+        print(f"Phases: {len(plan.get('phases', []))}")
+    
+    print(f"\n{SEP}\nCOST\n{SEP}")
+    if cost:
+        print(f"Min: ${cost.get('min', 'N/A'):,}" if isinstance(cost.get('min'), int) else f"Min: {cost.get('min', 'N/A')}")
+        print(f"Max: ${cost.get('max', 'N/A'):,}" if isinstance(cost.get('max'), int) else f"Max: {cost.get('max', 'N/A')}")
+    
+    print(f"\n{SEP}\nGENERATED PROPOSAL\n{SEP}")
+    if proposal:
+        # Show first 500 chars
+        if len(proposal) > 500:
+            print(proposal[:500] + f"\n\n[... {len(proposal)-500} more characters ...]")
+        else:
+            print(proposal)
+    else:
+        print("(No proposal generated)")
+
+
+async def test_real_emails(watch=False):
+    """Test agent with real Gmail emails; with watch, keep processing new mail as it arrives"""
+    
+    print(f"\nLLM Provider: {LLM_PROVIDER_LABEL}")
+    print(SEP)
     
     # Create LLM and graph
     llm = UnifiedLLM()
     graph = EmailAgentGraph(llm)
     
-    # Process each email
-    for idx, gmail_email in enumerate(emails, 1):
-        print("\n" + "=" * 80)
-        print(f"EMAIL #{idx}")
-        print("=" * 80)
-        print(f"From: {gmail_email['from']}")
-        print(f"Subject: {gmail_email['subject']}")
-        print(f"Body preview: {gmail_email['body'][:150]}...\n")
-        
-        initial_state = {
-            "messages": [],
-            "email_id": gmail_email["id"],
-            "email_from": gmail_email["from"],
-            "email_subject": gmail_email["subject"],
-            "email_body": gmail_email["body"],
-            "thread_id": gmail_email["id"],
-            "client_name": None,
-            "company": None,
-            "project_type": None,
-            "requirements": None,
-            "timeline": None,
-            "budget": None,
-            "project_plan": None,
-            "cost_estimate": None,
-            "proposal_text": None,
-            "is_valid_inquiry": False,
-            "confidence_score": 0.0,
-            "needs_human_review": False,
-            "current_step": "starting",
-            "error": None
-        }
-        
-        print("Processing with AI...\n")
-        result = await graph.graph.ainvoke(initial_state)
-        
-        # Save result for verification
-        with open("last_run_result.json", "w", encoding="utf-8") as f:
-            json.dump(result, f, indent=2, default=str)
-        
-        # Display results
-        print("=" * 80)
-        print("CLASSIFICATION")
-        print("=" * 80)
-        print(f"Valid: {result.get('is_valid_inquiry')}")
-        conf = result.get('confidence_score', 0)
-        if isinstance(conf, (int, float)):
-            print(f"Confidence: {conf:.0%}" if conf <= 1 else f"Confidence: {conf}%")
-        status = result.get('current_step', '?')
-        print(f"Status: {status}\n")
-        
-        if not result.get('is_valid_inquiry'):
-            print("(Skipping - not a valid inquiry)\n")
-            continue
-        
-        print("=" * 80)
-        print("EXTRACTED DATA")
-        print("=" * 80)
-        print(f"Client: {result.get('client_name', 'N/A')}")
-        print(f"Company: {result.get('company', 'N/A')}")
-        print(f"Project: {result.get('project_type', 'N/A')}")
-        print(f"Timeline: {result.get('timeline', 'N/A')}")
-        print(f"Budget: {result.get('budget', 'N/A')}\n")
-        
-        reqs = result.get('requirements')
-        if reqs and isinstance(reqs, list):
-            print("Requirements:")
-            for req in reqs:
-                print(f"  • {req}")
-        
-        print("\n" + "=" * 80)
-        print("PROJECT PLAN")
-        print("=" * 80)
-        plan = result.get('project_plan', {})
-        if plan:
-            print(f"Complexity: {plan.get('complexity', 'N/A')}")
-            print(f"Hours: {plan.get('total_estimated_hours', 'N/A')}")
-            print(f"Phases: {len(plan.get('phases', []))}")
-        
-        print("\n" + "=" * 80)
-        print("COST")
-        print("=" * 80)
-        cost = result.get('cost_estimate', {})
-        if cost:
-            print(f"Min: ${cost.get('min', 'N/A'):,}" if isinstance(cost.get('min'), int) else f"Min: {cost.get('min', 'N/A')}")
-            print(f"Max: ${cost.get('max', 'N/A'):,}" if isinstance(cost.get('max'), int) else f"Max: {cost.get('max', 'N/A')}")
-        
-        print("\n" + "=" * 80)
-        print("GENERATED PROPOSAL")
-        print("=" * 80)
-        proposal = result.get('proposal_text', '')
-        if proposal:
-            # Show first 500 chars
-            if len(proposal) > 500:
-                print(proposal[:500] + f"\n\n[... {len(proposal)-500} more characters ...]")
-            else:
-                print(proposal)
-        else:
-            print("(No proposal generated)")
+    # Bounded so fetching never runs far ahead of the workers
+    queue = asyncio.Queue(maxsize=4)
+    
+    async def produce(source):
+        found = 0
+        async for emails in source.stream(max_emails=2, watch=watch):
+            print(f"[OK] Found {len(emails)} email(s) to process\n")
+            states = [build_state(gmail_email) for gmail_email in emails]
+            # One LLM call triages the whole fetch; the graph then skips its triage node
+            updates = await graph.nodes.triage_batch(states)
+            for state, update in zip(states, updates):
+                if update:
+                    state.update(update)
+            for gmail_email, state in zip(emails, states):
+                found += 1
+                await queue.put((found, gmail_email, state))
+        for _ in range(WORKERS):
+            await queue.put(None)
+        return found
+    
+    async def consume(source, runs):
+        while (item := await queue.get()) is not None:
+            idx, gmail_email, _ = item
+            try:
+                await process_email(graph, *item, runs)
+            except Exception as e:
+                # Left unmarked, so the next run fetches it again
+                print(f"[ERROR] Failed to process email #{idx} ({gmail_email['id']}): {e}")
+                continue
+            source.mark_done(gmail_email["id"])
+    
+    # Graph runs overlap each other and the fetch instead of running back to back
+    async with GmailSource() as source:
+        with open(RUNS_FILE, "a", encoding="utf-8") as runs:
+            found, *_ = await asyncio.gather(produce(source), *(consume(source, runs) for _ in range(WORKERS)))
     
-    print("\n" + "=" * 80)
-    print("TEST COMPLETE")
-    print("=" * 80)
+    if not found:
+        print("\n[ERROR] No emails found. Exiting.")
+        return
+    
+    print(f"\n{SEP}\nTEST COMPLETE\n{SEP}")
 
 
-if __name__ == "__main__":
-    if not EMAIL_PASSWORD or EMAIL_PASSWORD == "xxxx xxxx xxxx xxxx":
-        print("=" * 80)
-        print("ERROR: Gmail app password not set!")
-        print("=" * 80)
+def _validate_env():
+    """Fail at startup, not mid-run, when the Gmail credentials are missing"""
+    if not EMAIL_USER:
+        print(f"{SEP}\nERROR: EMAIL_USER not set!\n{SEP}")
+        print("\nAdd your Gmail address to .env as: EMAIL_USER=you@gmail.com")
+        exit(1)
+    if not EMAIL_PASSWORD or EMAIL_PASSWORD == _PLACEHOLDER_PASSWORD:
+        print(f"{SEP}\nERROR: Gmail app password not set!\n{SEP}")
         print("\nYou need to:")
         print("1. Go to: https://myaccount.google.com/security")
         print("2. Find 'App passwords'")
         print("3. Generate password for Mail + Windows")
         print("4. Copy the 16-character password")
-        print("5. Paste it in .env as: EMAIL_PASSWORD=xxxx xxxx xxxx xxxx")
+        print(f"5. Paste it in .env as: EMAIL_PASSWORD={_PLACEHOLDER_PASSWORD}")
         print("\nThen run this script again.")
         exit(1)
-    
-    asyncio.run(test_real_emails())
+
+
+if __name__ == "__main__":
+    _validate_env()
+    asyncio.run(test_real_emails(watch="--watch" in sys.argv))
@@ -1,5 +1,9 @@
 """Test agent with a SAMPLE business inquiry email"""
 import asyncio
+import sys
+import textwrap
+from types import MappingProxyType
+from operator import itemgetter
 from agent.graph import EmailAgentGraph
 from integrations.llm_wrapper import UnifiedLLM
 import os
@@ -7,7 +11,15 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+LLM_PROVIDER_LABEL = os.getenv("LLM_PROVIDER", "gemini").upper()
+
+# Report fields, read from the result in one pass
+_REPORT_FIELDS = itemgetter(
+    "is_valid_inquiry", "confidence_score", "current_step", "client_name", "company", "project_type",
+    "timeline", "budget", "requirements", "project_plan", "cost_estimate", "proposal_text"
+)
+SEP = "=" * 80
+PROPOSAL_PREVIEW = 800
 
 # Sample real-world business inquiry
 SAMPLE_EMAIL = {
@@ -37,18 +49,39 @@ Tech Company Inc.
 john.smith@techcompany.com
 """
 }
+# Leading newline and indentation of the literal, stripped once at import
+SAMPLE_EMAIL["body"] = textwrap.dedent(SAMPLE_EMAIL["body"]).strip()
+
+# Everything but the message list is fixed for the sample, so the state is built once
+_INITIAL_STATE = MappingProxyType({
+    "email_id": "sample_001",
+    "email_from": SAMPLE_EMAIL["from"],
+    "email_subject": SAMPLE_EMAIL["subject"],
+    "email_body": SAMPLE_EMAIL["body"],
+    "thread_id": "sample_001",
+    "client_name": None,
+    "company": None,
+    "project_type": None,
+    "requirements": None,
+    "timeline": None,
+    "budget": None,
+    "project_plan": None,
+    "cost_estimate": None,
+    "proposal_text": None,
+    "is_valid_inquiry": False,
+    "confidence_score": 0.0,
+    "needs_human_review": False,
+    "current_step": "starting",
+    "error": None
+})
 
 async def test_sample_inquiry():
     """Test agent with sample business inquiry"""
     
-    print("\n" + "=" * 80)
-    print("TESTING WITH SAMPLE BUSINESS INQUIRY")
-    print("=" * 80)
-    print(f"\nLLM Provider: {LLM_PROVIDER.upper()}\n")
+    print(f"\n{SEP}\nTESTING WITH SAMPLE BUSINESS INQUIRY\n{SEP}")
+    print(f"\nLLM Provider: {LLM_PROVIDER_LABEL}\n")
     
-    print("=" * 80)
-    print("EMAIL DETAILS")
-    print("=" * 80)
+    print(f"{SEP}\nEMAIL DETAILS\n{SEP}")
     print(f"From: {SAMPLE_EMAIL['from']}")
     print(f"Subject: {SAMPLE_EMAIL['subject']}")
     print(f"\nBody:\n{SAMPLE_EMAIL['body'][:300]}...\n")
@@ -57,66 +90,54 @@ async def test_sample_inquiry():
     llm = UnifiedLLM()
     graph = EmailAgentGraph(llm)
     
-    initial_state = {
-        "messages": [],
-        "email_id": "sample_001",
-        "email_from": SAMPLE_EMAIL["from"],
-        "email_subject": SAMPLE_EMAIL["subject"],
-        "email_body": SAMPLE_EMAIL["body"],
-        "thread_id": "sample_001",
-        "client_name": None,
-        "company": None,
-        "project_type": None,
-        "requirements": None,
-        "timeline": None,
-        "budget": None,
-        "project_plan": None,
-        "cost_estimate": None,
-        "proposal_text": None,
-        "is_valid_inquiry": False,
-        "confidence_score": 0.0,
-        "needs_human_review": False,
-        "current_step": "starting",
-        "error": None
-    }
+    # Frozen template; messages is mutable, so each run gets its own list
+    initial_state = dict(_INITIAL_STATE, messages=[])
     
     print("Processing with AI...\n")
-    result = await graph.graph.ainvoke(initial_state)
+    result, streamed = None, 0
+    # Custom events carry the proposal as it is generated; the preview prints live and
+    # past PROPOSAL_PREVIEW characters only the running length is kept
+    async for mode, chunk in graph.graph.astream(initial_state, stream_mode=["custom", "values"]):
+        if mode == "values":
+            result = chunk
+            continue
+        text = chunk["proposal_chunk"]
+        if not streamed:
+            print(f"{SEP}\nGENERATED PROPOSAL (First {PROPOSAL_PREVIEW} characters, streamed)\n{SEP}")
+        if streamed < PROPOSAL_PREVIEW:
+            sys.stdout.write(text[:PROPOSAL_PREVIEW - streamed])
+            sys.stdout.flush()
+        streamed += len(text)
+    if streamed:
+        extra = streamed - PROPOSAL_PREVIEW
+        print(f"\n\n... [{extra} more characters] ...\n" if extra > 0 else "\n")
+    (is_valid, conf, status, client_name, company, project_type,
+     timeline, budget, reqs, plan, cost, proposal) = _REPORT_FIELDS(result)
     
     # Display results
-    print("=" * 80)
-    print("CLASSIFICATION")
-    print("=" * 80)
-    print(f"Valid Inquiry: {result.get('is_valid_inquiry')}")
-    conf = result.get('confidence_score', 0)
+    print(f"{SEP}\nCLASSIFICATION\n{SEP}")
+    print(f"Valid Inquiry: {is_valid}")
     if isinstance(conf, (int, float)):
         print(f"Confidence: {conf:.0%}" if conf <= 1 else f"Confidence: {conf}%")
-    status = result.get('current_step', '?')
     print(f"Status: {status}\n")
     
-    if not result.get('is_valid_inquiry'):
+    if not is_valid:
         print("[Skipping remaining steps - not a valid inquiry]\n")
         return
     
-    print("=" * 80)
-    print("EXTRACTED INFORMATION")
-    print("=" * 80)
-    print(f"Client Name: {result.get('client_name', 'N/A')}")
-    print(f"Company: {result.get('company', 'N/A')}")
-    print(f"Project Type: {result.get('project_type', 'N/A')}")
-    print(f"Timeline: {result.get('timeline', 'N/A')}")
-    print(f"Budget: {result.get('budget', 'N/A')}\n")
+    print(f"{SEP}\nEXTRACTED INFORMATION\n{SEP}")
+    print(f"Client Name: {client_name}")
+    print(f"Company: {company}")
+    print(f"Project Type: {project_type}")
+    print(f"Timeline: {timeline}")
+    print(f"Budget: {budget}\n")
     
-    reqs = result.get('requirements')
     if reqs and isinstance(reqs, list):
         print("Requirements:")
         for i, req in enumerate(reqs, 1):
             print(f"  {i}. {req}")
     
-    print("\n" + "=" * 80)
-    print("PROJECT PLAN")
-    print("=" * 80)
-    plan = result.get('project_plan', {})
+    print(f"\n{SEP}\nPROJECT PLAN\n{SEP}")
     if plan:
         print(f"Complexity: {plan.get('complexity', 'N/A')}")
         print(f"Total Hours: {plan.get('total_estimated_hours', 'N/A')}")
@@ -131,10 +152,7 @@ async def test_sample_inquiry():
                     hours = phase.get('hours', 'N/A')
                     print(f"  Phase {i}: {name} - {hours} hours")
     
-    print("\n" + "=" * 80)
-    print("COST ESTIMATE")
-    print("=" * 80)
-    cost = result.get('cost_estimate', {})
+    print(f"\n{SEP}\nCOST ESTIMATE\n{SEP}")
     if cost:
         min_cost = cost.get('min', 'N/A')
         max_cost = cost.get('max', 'N/A')
@@ -144,21 +162,18 @@ async def test_sample_inquiry():
             print(f"Estimated Range: {min_cost} - {max_cost}")
         print(f"Rate: {cost.get('rate', 'N/A')}")
     
-    print("\n" + "=" * 80)
-    print("GENERATED PROPOSAL (First 800 characters)")
-    print("=" * 80)
-    proposal = result.get('proposal_text', '')
-    if proposal:
-        if len(proposal) > 800:
-            print(proposal[:800] + f"\n\n... [{len(proposal)-800} more characters] ...")
+    # Already shown while streaming; fallback proposals arrive in one piece with the result
+    if not streamed:
+        print(f"\n{SEP}\nGENERATED PROPOSAL (First {PROPOSAL_PREVIEW} characters)\n{SEP}")
+        if proposal:
+            if len(proposal) > PROPOSAL_PREVIEW:
+                print(proposal[:PROPOSAL_PREVIEW] + f"\n\n... [{len(proposal)-PROPOSAL_PREVIEW} more characters] ...")
+            else:
+                print(proposal)
         else:
-            print(proposal)
-    else:
-        print("[No proposal generated]")
+            print("[No proposal generated]")
     
-    print("\n" + "=" * 80)
-    print("TEST COMPLETE - SUCCESS!")
-    print("=" * 80)
+    print(f"\n{SEP}\nTEST COMPLETE - SUCCESS!\n{SEP}")
     print(f"\nThis demonstrates the full workflow:")
     print("1. Email received and classified as valid/invalid")
     print("2. Project details extracted")